@@ -1,100 +1,154 @@
-from collections import Counter
-from functools import reduce
-from itertools import permutations
-from math import ceil, floor, sqrt
-from random import random, choice
+from itertools import product
+from operator import itemgetter
 from constants import *
 from helperFunctions import *
+import StateTable
+from profiling import timed
+
+def lines(rows, cols, k):
+    """ Returns the lines of k fields (horizontal, vertical and diagonal) on a rows x cols board """
+    result = []
+    for r, c, (dr, dc) in product(range(rows), range(cols), [(0, 1), (1, 0), (1, 1), (1, -1)]):
+        if 0 <= r + (k-1)*dr < rows and 0 <= c + (k-1)*dc < cols:
+            result.append(tuple((r + i*dr) * cols + c + i*dc for i in range(k)))
+    return result
+
+def symmetries(rows, cols):
+    """ Returns the symmetries of a rows x cols board as permutations of the fields, board[perm[i]] moves to i """
+    flips = [lambda r, c: (r, c), lambda r, c: (rows-1 - r, c), lambda r, c: (r, cols-1 - c), lambda r, c: (rows-1 - r, cols-1 - c)]
+    perms = [tuple(f(r, c)[0] * cols + f(r, c)[1] for r in range(rows) for c in range(cols)) for f in flips]
+    if rows == cols:  # a square board can also be transposed, which together with the flips gives all rotations
+        perms += [tuple(perm[c * cols + r] for r in range(rows) for c in range(cols)) for perm in perms]
+    return perms
+
+# the lines of K fields, as indices and as bit masks over the fields
+LINES = lines(ROWS, COLS, K)
+LINE_MASKS = [sum(1 << i for i in line) for line in LINES]
+FULL_MASK = (1 << SIZE) - 1
+SYMMETRIES = symmetries(ROWS, COLS)
+SYMMETRY_GETTERS = [itemgetter(*perm) for perm in SYMMETRIES]  # board -> permuted board
+
+# the fields of every combination of CHUNK bits of X and O, such that a board is unpacked CHUNK fields at a time
+CHUNK = 3
+CHUNK_MASK = (1 << CHUNK) - 1
+CHUNK_FIELDS = [tuple(X if x >> i & 1 else (O if o >> i & 1 else EMPTY) for i in range(CHUNK))
+                for o in range(1 << CHUNK) for x in range(1 << CHUNK)]
 
 class Board:
+    # the position is packed in two bitboards, bit i of __x (__o) is set iff field i is marked by X (O)
+    __slots__ = ("__x", "__o")
+
     def __init__(self, board=None):
-        self.__board = tuple((EMPTY for _ in range(SIZE)))
+        self.__x = 0
+        self.__o = 0
 
         if board is not None:
             self.set_board(board)
 
     def __repr__(self):
-        return ''.join(map(str, self.__board))
+        return ''.join(map(str, self.get_board()))
+
+    def __eq__(self, other):
+        return isinstance(other, Board) and self.get_bits() == other.get_bits()
+
+    def __hash__(self):
+        return self.__x | self.__o << SIZE
 
     def get_board(self):
-        return self.__board
+        x, o = self.__x, self.__o
+        board = ()
+        for shift in range(0, SIZE, CHUNK):
+            board += CHUNK_FIELDS[(x >> shift & CHUNK_MASK) | (o >> shift & CHUNK_MASK) << CHUNK]
+        return board[:SIZE]
+
+    def get_bits(self):
+        return self.__x, self.__o
     
     def is_full(self):
-        return EMPTY not in self.__board
+        return self.__x | self.__o == FULL_MASK
     
     def set_board(self, board):
         if Board.is_valid(board):
-            self.__board = board
+            self.__x, self.__o = Board.pack(board)
         else:
             raise Exception("Invalid board")
 
+    def get_id(self):
+        return StateTable.get_table().id(self.get_board())
+
     def player_to_move(self):
-        markings = Counter(self.__board)
-        return O if markings[EMPTY] % 2 == 0 else X
+        return O if self.__x.bit_count() > self.__o.bit_count() else X
 
     def get_next_boards(self):
-        """ Returns a set of valid boards which follow self.__board"""
-        player_to_move = self.player_to_move()
-        possible_moves = set()
-        
-        w_n, _ = Board.has_winner(self.__board)
-        if w_n == 1:
-            return {self.__board} 
-
-        for i, field in enumerate(self.__board):
-            if field != EMPTY:
-                continue
-            # field is empty
-
-            possible_next_move = replace(self.__board, i, player_to_move)
-            if Board.is_valid(possible_next_move):
-                # possible move is a valid move
-                possible_moves.add(possible_next_move)
-        
-        return possible_moves
+        """ Returns the set of valid boards (tuple repr) which follow this board, looked up in the state table """
+        return StateTable.get_table().next_boards(self.get_board())
 
+    @staticmethod
+    def canonical(board: tuple[int]) -> tuple[int]:
+        """ Returns the representative of the class of boards which are symmetric to board """
+        return min(getter(board) for getter in SYMMETRY_GETTERS)
 
     @staticmethod
+    def pack(board: tuple[int]) -> tuple[int, int]:
+        """ Returns the bitboards of X and O of a board """
+        x, o = 0, 0
+        for i, field in enumerate(board):
+            if field == X:
+                x |= 1 << i
+            elif field == O:
+                o |= 1 << i
+        return x, o
+
+    @staticmethod
+    @timed
     def is_valid(board: tuple[int]):
+        # every board in the state table is valid, so only unknown boards have to be checked
+        if isinstance(board, tuple) and board in StateTable.get_table():
+            return True
+
         # correct shape
         corr_shape = len(board) == SIZE
         if not corr_shape:
             return False
 
         # correct markings, EMPTY, X, O
-        markings = Counter(board)
-        corr_markings = reduce(lambda x, y: x in [EMPTY, X, O] and y in [EMPTY, X, O], markings.keys()) or list(markings.keys()) == [0]
+        corr_markings = all(field in (EMPTY, X, O) for field in board)
 
         # number of winners <= 1
-        number_of_winners, winner = Board.has_winner(board)
+        x, o = Board.pack(board)
+        number_of_winners, winner = Board.bits_winner(x, o)
         corr_n_winners = number_of_winners <= 1
 
         # correct number of X's and O's
-        corr_n_markings = (0 <= markings[X] - markings[O] <= 1 and number_of_winners == 0) \
-                    or (number_of_winners == 1 and winner == X and markings[X] == markings[O] + 1) \
-                    or (number_of_winners == 1 and winner == O and markings[X] == markings[O])
+        n_x, n_o = x.bit_count(), o.bit_count()
+        corr_n_markings = (0 <= n_x - n_o <= 1 and number_of_winners == 0) \
+                    or (number_of_winners == 1 and winner == X and n_x == n_o + 1) \
+                    or (number_of_winners == 1 and winner == O and n_x == n_o)
 
         return corr_shape and corr_markings and corr_n_winners and corr_n_markings 
     
     @staticmethod
+    @timed
     def has_winner(board: list[int]) -> tuple[int, int]:
         """
         This function will return the numbers of winners on the board. Iff the number of winners is 1 then winner will indicate
         the player who won. If the number of winners is 0 winner will be an empty string and if the number of winners is 2
         winner will be arbitrary.
         """
+        return Board.bits_winner(*Board.pack(board))
 
-        lines = [(i*3 + 0,i*3 + 1,i*3 + 2) for i in range(3)] + [(0+i,3+i,6+i) for i in range(3)] + [(0, 4, 8), (2, 4, 6)]
-
-        winner = T
-        number_of_winners = 0
-        for line in lines:
-            if board[line[0]] == board[line[1]] and board[line[1]] == board[line[2]] and board[line[2]] != EMPTY:
-                # A line has the same non-empty marking
-                if winner != board[line[0]] and number_of_winners < 2:
-                    # if the winner is not of the marking and we do not have two markings as winners we update
-                    # the marking and add one winner
-                    number_of_winners += 1
-                    winner = board[line[0]]
-
-        return number_of_winners, winner
\ No newline at end of file
+    @staticmethod
+    def bits_winner(x: int, o: int) -> tuple[int, int]:
+        """ has_winner of the board with bitboards x and o, a line is won if all of its bits are set """
+        x_wins, o_wins = False, False
+        for mask in LINE_MASKS:
+            if x & mask == mask:
+                x_wins = True
+            elif o & mask == mask:
+                o_wins = True
+
+        if x_wins and o_wins:
+            return 2, X
+        if x_wins or o_wins:
+            return 1, X if x_wins else O
+        return 0, T
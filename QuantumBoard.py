@@ -1,17 +1,31 @@
-from collections import Counter
-from functools import reduce
-from itertools import permutations
-from math import ceil, floor, sqrt, sin, cos, pi
-from numpy import arcsin
-from random import random, choice
+from heapq import nlargest
+from bisect import bisect_right
+from itertools import accumulate
+from math import floor, sqrt, sin, cos, pi, fsum, asin
+import numpy as np
+from os import environ as _environ
+from random import random, Random
 from constants import *
 from helperFunctions import *
 from ClassicalBoard import Board
+from StateTable import get_table
+from profiling import timed
+
+# fraction of the superpositions constructed by the engine itself (see QuBoard.trusted) which are validated anyway
+VALIDATE_RATE = float(_environ.get("TTT_VALIDATE_RATE", "0"))
+_validation_random = Random()  # decides which trusted superpositions are validated, apart from the random choices of the games
+
+
+def uniforms(k, rng=None):
+    """ Returns an array of k uniform numbers in [0, 1) drawn from rng, from the random module if None """
+    return np.array([random() for _ in range(k)]) if rng is None else rng.random(k)
 
 
 class QuBoard:
+    @timed
     def __init__(self, decomp=None):
-        self.__decomposition = {tuple((0 for _ in range(9))): 1}  # {|psi>: a_psi}
+        self.__decomposition = {tuple((EMPTY for _ in range(SIZE))): 1}  # {|psi>: a_psi}
+        self.__cdf = None  # (boards, cumulative probabilities) for measuring, cached until the decomposition changes
         # NOTE decomposition keys are tuples since making Board classes keys distinguishes the same states
         # by different class-pointers
 
@@ -21,37 +35,90 @@ class QuBoard:
     def __repr__(self):
         return " \n".join(map(lambda x : f"{x} : {round(self.__decomposition[x], 3)}...", list(self.__decomposition.keys())))
 
+    @classmethod
+    @timed
+    def trusted(cls, decomp):
+        """ Constructs a superposition produced by the engine itself (e.g. by the moves of the strategies), which is valid
+        by construction and therefore only validated at the rate VALIDATE_RATE """
+        if VALIDATE_RATE and _validation_random.random() < VALIDATE_RATE:
+            return cls(decomp)
+        quboard = cls.__new__(cls)
+        quboard.__decomposition = decomp
+        quboard.__cdf = None
+        return quboard
+
     def set_decomp(self, decomp):
         if not QuBoard.is_valid(decomp):
             print(sum(map(lambda x: x, decomp.values())))
             raise Exception ("Invalid quantum board decomposition")
 
         self.__decomposition = decomp
+        self.__cdf = None
+        self.normalize()
+
+    def normalize(self):
+        """ Rescales the decomposition to a total probability of 1 by its compensated sum (math.fsum), once the
+        floating point drift of the moves and amplifications is measurable """
+        total = fsum(self.__decomposition.values())
+        if abs(total - 1) > 1e-12:
+            self.__decomposition = {board: a / total for board, a in self.__decomposition.items()}
+            self.__cdf = None
     
     def get_decomp(self):
         return self.__decomposition
     
     def is_empty(self):
-        return self.__decomposition == {tuple((0 for _ in range(9))): 1}
+        return self.__decomposition == {tuple((EMPTY for _ in range(SIZE))): 1}
+
+    def prune(self, threshold=0, top_k=None):
+        """ Approximates the superposition by its most probable boards: drops the boards with a probability below 
+        threshold and all but the top_k most probable boards (the most probable board is always kept), and 
+        renormalizes. Returns the discarded probability """
+        kept = {board: a for board, a in self.__decomposition.items() if a >= threshold}
+        if top_k is not None and len(kept) > top_k:
+            kept = dict(nlargest(top_k, kept.items(), key=lambda item: item[1]))
+        if len(kept) == len(self.__decomposition):
+            return 0
+        if not kept:
+            kept = dict([max(self.__decomposition.items(), key=lambda item: item[1])])
+
+        total = fsum(self.__decomposition.values())
+        kept_total = fsum(kept.values())
+        self.__decomposition = {board: a / kept_total * total for board, a in kept.items()}
+        self.__cdf = None
+        return (total - kept_total) / total
     
-    def measure(self):
-        bench = random()
-        sum = 0
-        for board in self.__decomposition:
-            sum += self.__decomposition[board]
-            if sum > bench:
-                # collapse to board
-                self.__decomposition = {board: 1}
-                return Board(board)
-        
-        # by floating point error no collapse happend
-        print("No collapse by floating point error")
-        return self.measure()
+    def sample(self, k, rng=None):
+        """ Draws k boards from the superposition (with replacement) without collapsing it """
+        return self.__select(uniforms(k, rng))
+
+    def __select(self, benches):
+        """ The boards at the uniform numbers benches in [0, 1) of the cumulative distribution """
+        if self.__cdf is None:
+            boards = list(self.__decomposition.keys())
+            self.__cdf = (boards, list(accumulate(self.__decomposition[board] for board in boards)))
+        boards, cdf = self.__cdf
+
+        # drawing relative to the total makes a draw certain despite floating point errors, by binary search
+        return [Board(boards[min(bisect_right(cdf, bench * cdf[-1]), len(boards) - 1)]) for bench in benches]
+
+    @timed
+    def measure(self, rng=None, measurement=None):
+        """ Measures the superposition with the uniform number measurement in [0, 1), drawn from rng if None """
+        board = self.__select(uniforms(1, rng) if measurement is None else [measurement])[0]
+
+        # collapse to board
+        self.__decomposition = {board.get_board(): 1}
+        self.__cdf = None
+        return board
     
+    @timed
     def amplify(self, B_M, n=None):
         """ This method will simulate a amplitude amplification """
 
-        good_boards = B_M & self.__decomposition.keys()
+        # membership is tested once per board of the decomposition instead of intersecting it with B_M
+        good = {board: board in B_M for board in self.__decomposition}
+        good_boards = [board for board, is_good in good.items() if is_good]
 
         # first determine a NOTE in this simulation coefficients are already squared and never complex
         a = sum([abs(self.__decomposition[board]) for board in good_boards])
@@ -66,7 +133,7 @@ class QuBoard:
             return
 
         # determine theta following THE paper
-        theta = arcsin(sqrt(a))
+        theta = asin(sqrt(a))
 
         if n is None:
             # No specific n specified so n will be determined
@@ -79,10 +146,12 @@ class QuBoard:
         #print(f"good coeff {p_good_coeff} bad coeff {p_bad_coeff}")
 
         for board in self.__decomposition.keys():  # multiply states with proper coefficients
-            if board in B_M:
+            if good[board]:
                 self.__decomposition[board] *= p_good_coeff
             else:
                 self.__decomposition[board] *= p_bad_coeff
+        self.__cdf = None
+        self.normalize()
         
         return
 
@@ -90,6 +159,7 @@ class QuBoard:
 
     @staticmethod
     def sum(qu_boards):
+        """ Returns the equal mixture of the superpositions qu_boards (coefficients are squared, so weights 1/n) """
         n = len(qu_boards)
         decomp_sum = dict()
 
@@ -97,14 +167,15 @@ class QuBoard:
             decomp = qu_board.get_decomp()
             
             for board in decomp.keys():
-                if board in decomp_sum.keys():  # TODO update sqrt
-                    decomp_sum[board] += decomp[board] * sqrt(n)
+                if board in decomp_sum.keys():
+                    decomp_sum[board] += decomp[board] / n
                 else:
-                    decomp_sum[board] = decomp[board] * sqrt(n)
+                    decomp_sum[board] = decomp[board] / n
 
         return QuBoard(decomp_sum)
 
     @staticmethod
+    @timed
     def is_valid(q_board):
         bool = True
 
@@ -112,4 +183,206 @@ class QuBoard:
             bool &= Board.is_valid(classic_board)
         
         return bool and abs(sum(map(lambda x: x, q_board.values())) - 1) < 0.0001
-        
\ No newline at end of file
+        
+
+class TransitionMatrix:
+    """ Sparse (CSR) stochastic matrix over the board ids, row i holds the probabilities of the boards following i """
+    def __init__(self, ptr, ids, weights):
+        self.ptr = ptr
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.weights = weights
+        self.rows = np.repeat(np.arange(len(ptr) - 1), np.diff(ptr))  # row of every entry
+
+    @timed
+    def apply(self, probs):
+        """ Returns the probability vector after a move from the probability vector probs (a sparse mat-vec) """
+        return np.bincount(self.ids, weights=self.weights * probs[self.rows], minlength=len(probs))
+
+    def scale(self, factors):
+        """ Returns the matrix with row i multiplied by factors[i] """
+        return TransitionMatrix(self.ptr, self.ids, self.weights * factors[self.rows])
+
+    @staticmethod
+    def sum(matrices):
+        """ Returns the sum of the matrices """
+        rows = np.concatenate([matrix.rows for matrix in matrices])
+        order = np.argsort(rows, kind="stable")  # keep the entries ordered by row
+        ptr = np.zeros(len(matrices[0].ptr), dtype=np.int64)
+        ptr[1:] = np.cumsum(np.bincount(rows, minlength=len(ptr) - 1))
+        return TransitionMatrix(ptr, np.concatenate([matrix.ids for matrix in matrices])[order], 
+                                np.concatenate([matrix.weights for matrix in matrices])[order])
+
+    @staticmethod
+    def uniform(ptr, ids):
+        """ The matrix which moves from every board to each of its successors ptr, ids with equal probability """
+        counts = np.diff(ptr)
+        return TransitionMatrix(ptr, ids, np.repeat(1 / np.maximum(counts, 1), counts))
+
+
+class Pruning:
+    """
+    Approximate superpositions of bounded size: the superposition of a game is pruned after every move (see 
+    QuBoard.prune), trading the accuracy of the outcome for the cost of the moves. Records the discarded probability
+    per ply, summed over the games it is applied to.
+    """
+    def __init__(self, threshold=0, top_k=None):
+        self.threshold = threshold
+        self.top_k = top_k
+        self.discarded = np.zeros(SIZE + 1)  # move -> discarded probability summed over the games
+        self.games = 0
+
+    def __call__(self, board, move):
+        self.discarded[move] += board.prune(self.threshold, self.top_k)
+
+    def mean_discarded(self):
+        """ The mean discarded probability per ply of a game """
+        return self.discarded / max(self.games, 1)
+
+    def __repr__(self):
+        return f"Pruning(threshold={self.threshold}, top_k={self.top_k})"
+
+
+def optimal_iterations(theta):
+    """ The number of Grover iterations which maximizes the probability of the good states, per angle theta """
+    return np.floor(pi / (4 * theta))
+
+
+@timed
+def amplify_batch(probs, good, n=None):
+    """
+    Simulates amplitude amplification on a probability vector over the board ids, or on a games x states array of
+    them at once, and returns the amplified probabilities. good is a boolean mask over the ids (e.g. StateTable.mask
+    of B_X) or a games x states array of masks. n is the number of iterations: an int, an array with an int per game,
+    or a schedule which maps the angles theta of the games to their iterations (None is optimal_iterations).
+    """
+    probs = np.asarray(probs, dtype=float)
+
+    # NOTE in this simulation coefficients are already squared and never complex
+    a = probs @ good if np.ndim(good) == 1 else np.where(good, probs, 0).sum(axis=-1)
+
+    # we assume 0 < a < 1 otherwise amplification will have no effect (only good or only bad states)
+    amplified = (a >= 0.0001) & (np.abs(a - 1) >= 0.0001)
+    a = np.where(amplified, a, 0.5)  # any value with well defined coefficients, these games are left as they are
+
+    theta = np.arcsin(np.sqrt(a))
+    if n is None:
+        n = optimal_iterations
+    if callable(n):
+        n = n(theta)
+
+    # applying Q n times
+    good_coeff = np.where(amplified, np.sin((2*n+1)*theta)**2 / a, 1)
+    bad_coeff = np.where(amplified, np.cos((2*n+1)*theta)**2 / (1-a), 1)
+    return probs * np.where(good, good_coeff[..., None], bad_coeff[..., None])
+
+
+class DenseQuBoard:
+    """
+    Quantum board which stores its decomposition as a probability vector indexed by the board ids of the state table,
+    such that moves, amplification and measurement are vector operations. get_decomp offers the QuBoard view.
+    """
+    @timed
+    def __init__(self, decomp=None):
+        self.__table = get_table()
+        self.__empty_id = self.__table.id(tuple((EMPTY for _ in range(SIZE))))
+        self.__probs = np.zeros(len(self.__table))
+        self.__probs[self.__empty_id] = 1
+        self.__cdf = None  # cumulative probabilities for measuring, cached until the probabilities change
+
+        if decomp is not None:
+            self.set_decomp(decomp)
+
+    def __repr__(self):
+        return " \n".join(map(lambda x : f"{x[0]} : {round(x[1], 3)}...", self.get_decomp().items()))
+
+    @classmethod
+    @timed
+    def trusted(cls, probs):
+        """ Constructs a superposition produced by the engine itself from its probability vector, see QuBoard.trusted """
+        if VALIDATE_RATE and _validation_random.random() < VALIDATE_RATE:
+            return cls(probs)
+        quboard = cls.__new__(cls)
+        quboard.__table = get_table()
+        quboard.__empty_id = quboard.__table.id(tuple((EMPTY for _ in range(SIZE))))
+        quboard.__probs = probs
+        quboard.__cdf = None
+        return quboard
+
+    def set_decomp(self, decomp):
+        """ Sets the decomposition from a dict {|psi>: a_psi} or a probability vector over the board ids """
+        if isinstance(decomp, dict):
+            if not QuBoard.is_valid(decomp):
+                raise Exception ("Invalid quantum board decomposition")
+            probs = np.zeros(len(self.__table))
+            # accumulated, since boards which are symmetric to each other share the id of their canonical board
+            np.add.at(probs, [self.__table.id(board) for board in decomp.keys()], list(decomp.values()))
+            decomp = probs
+
+        if len(decomp) != len(self.__table) or (decomp < 0).any() or abs(decomp.sum() - 1) > 0.0001:
+            raise Exception ("Invalid quantum board decomposition")
+
+        self.__probs = decomp
+        self.__cdf = None
+
+    def get_decomp(self):
+        return {self.__table.boards[i]: float(self.__probs[i]) for i in np.flatnonzero(self.__probs)}
+
+    def get_probs(self):
+        return self.__probs
+
+    def prune(self, threshold=0, top_k=None):
+        """ Approximates the superposition by its most probable boards and returns the discarded probability, see 
+        QuBoard.prune """
+        kept = self.__probs >= max(threshold, np.finfo(float).tiny)
+        if top_k is not None and np.count_nonzero(kept) > top_k:
+            top = np.argpartition(np.where(kept, self.__probs, 0), -top_k)[-top_k:]
+            kept = np.zeros(len(self.__probs), dtype=bool)
+            kept[top] = True
+        if not kept.any():
+            kept[np.argmax(self.__probs)] = True
+        if np.count_nonzero(kept) == np.count_nonzero(self.__probs):
+            return 0
+
+        total = self.__probs.sum()
+        probs = np.where(kept, self.__probs, 0)
+        discarded = 1 - probs.sum() / total
+        self.__probs = probs * (total / probs.sum())
+        self.__cdf = None
+        return discarded
+
+    def is_empty(self):
+        return self.__probs[self.__empty_id] == 1
+
+    def sample_ids(self, k, rng=None):
+        """ Draws the ids of k boards from the superposition (with replacement) without collapsing it """
+        return self.__select(uniforms(k, rng))
+
+    def __select(self, benches):
+        """ The ids at the uniform numbers benches in [0, 1) of the cumulative distribution """
+        if self.__cdf is None:
+            self.__cdf = np.cumsum(self.__probs)
+
+        # drawing relative to the total makes a draw certain despite floating point errors, by binary search
+        return np.minimum(np.searchsorted(self.__cdf, benches * self.__cdf[-1], side="right"), len(self.__cdf) - 1)
+
+    def sample(self, k, rng=None):
+        """ Draws k boards from the superposition (with replacement) without collapsing it """
+        return [Board(self.__table.boards[i]) for i in self.sample_ids(k, rng)]
+
+    @timed
+    def measure(self, rng=None, measurement=None):
+        """ Measures the superposition with the uniform number measurement in [0, 1), drawn from rng if None """
+        i = int(self.__select(uniforms(1, rng) if measurement is None else np.array([measurement]))[0])
+
+        # collapse to board
+        self.__probs = np.zeros(len(self.__table))
+        self.__probs[i] = 1
+        self.__cdf = None
+        return Board(self.__table.boards[i])
+
+    @timed
+    def amplify(self, B_M, n=None):
+        """ This method will simulate a amplitude amplification, B_M is a set of boards or a mask over the ids """
+        good = B_M if isinstance(B_M, np.ndarray) else self.__table.mask(B_M)
+        self.__probs = amplify_batch(self.__probs, good, n)
+        self.__cdf = None
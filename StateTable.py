@@ -0,0 +1,285 @@
+import hashlib
+import json
+import os
+from collections.abc import Sequence
+import numpy as np
+import ClassicalBoard
+from constants import *
+from helperFunctions import *
+
+CACHE_VERSION = 4  # increase whenever the layout or the meaning of the cached arrays changes
+CACHE_DIR = os.environ.get("TTT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+
+class StateTable:
+    """
+    Table of all reachable boards, built once. Every board gets an integer id (its index in self.boards) and all
+    per-board properties are stored in arrays indexed by that id, such that a move is a lookup instead of a scan.
+
+    A symmetric table only stores the canonical board (see Board.canonical) of every class of symmetric boards. 
+    Boards are looked up by their canonical board, and the successors of a board are canonical boards listed as often
+    as there are moves leading to them, such that choosing uniformly from them keeps the probabilities of the moves.
+    """
+    def __init__(self, arrays=None, symmetric=SYMMETRIC):
+        if arrays is None:
+            arrays = StateTable.build(symmetric)
+        self.arrays = arrays  # name -> numpy array, the (cacheable) contents of the table
+        self.symmetric = bool(arrays["symmetric"])
+
+        self.codes = arrays["codes"]  # id -> base-3 code of the board
+        self.winner = arrays["winner"]  # id -> winning player, T if there is none
+        self.to_move = arrays["to_move"]
+        self.win_class = arrays["win_class"]  # id -> win-state X, O or T
+
+        # the boards and successors are views of the (memory-mapped) arrays, which are only decoded on access, such
+        # that processes share the pages of the cached table instead of each building Python objects of all boards
+        self.boards = Boards(self.codes)  # id -> board (tuple repr)
+        self.sorted_codes, self.code_order = arrays["sorted_codes"], arrays["code_order"]  # lookup of ids by code
+        self.__ids = {}  # board (tuple repr) -> id (-1 if not in the table), of the boards looked up by this process
+        self.__good_boards, self.__mistake_boards = {}, {}  # board -> list of boards, of the rows decoded by this process
+
+        # id -> tuple of ids. The successors mirror Board.get_next_boards, good successors stay in the win-state of
+        # the board and mistakes (only made on tied boards) hand the other player the win
+        self.successors = Successors(arrays["successor_ptr"], arrays["successor_ids"])
+        self.good_successors = Successors(arrays["good_ptr"], arrays["good_ids"])
+        self.mistake_successors = Successors(arrays["mistake_ptr"], arrays["mistake_ids"])
+
+        self.__masks = {}  # id of a set of boards -> (set of boards, boolean array over the ids)
+
+    def __len__(self):
+        return len(self.boards)
+
+    def __contains__(self, board):
+        return self.lookup(board) is not None
+
+    @staticmethod
+    def build(symmetric=SYMMETRIC):
+        """ Enumerates and solves all reachable (canonical) boards, returns the arrays of the table """
+        boards, ids = [], {}
+
+        def add(board):
+            if symmetric:
+                board = ClassicalBoard.Board.canonical(board)
+            if board not in ids:
+                ids[board] = len(boards)
+                boards.append(board)
+            return ids[board]
+
+        winner = []  # id -> winning player, T if there is none
+
+        def expand(board):
+            w_n, w = ClassicalBoard.Board.has_winner(board)
+            winner.append(w if w_n == 1 else T)
+            if w_n == 1:
+                return (ids[board],)  # a won board only follows itself
+
+            player = O if board.count(X) > board.count(O) else X
+            return tuple(add(replace(board, i, player)) for i, field in enumerate(board) if field == EMPTY)
+
+        # enumerate all reachable boards forward from the empty board, ply by ply. Since every successor is one
+        # ply further, the ids are ordered by the number of moves made.
+        add(tuple((EMPTY for _ in range(SIZE))))
+        successors = []
+        while len(successors) < len(boards):
+            successors.append(expand(boards[len(successors)]))
+
+        n = len(boards)
+        to_move = [O if board.count(X) > board.count(O) else X for board in boards]
+
+        # retrograde analysis: determine the win-state of every board by walking backwards from the last ply
+        win_class = [T] * n
+        for i in reversed(range(n)):
+            if winner[i] != T or EMPTY not in boards[i]:
+                win_class[i] = winner[i]
+            else:
+                win_class[i] = state_max([win_class[j] for j in successors[i]], to_move[i])
+
+        good = [tuple(j for j in successors[i] if win_class[j] == win_class[i]) for i in range(n)]
+        mistakes = [tuple(j for j in successors[i] if win_class[i] == T and win_class[j] == (X if to_move[i] == O else O))
+                    for i in range(n)]
+
+        codes = encode(boards)
+        arrays = {"codes": codes, "code_order": np.argsort(codes), "sorted_codes": np.sort(codes), "winner": np.array(winner, dtype=np.int8), 
+                  "to_move": np.array(to_move, dtype=np.int8), "win_class": np.array(win_class, dtype=np.int8),
+                  "symmetric": np.array(symmetric)}
+        arrays["successor_ptr"], arrays["successor_ids"] = to_csr(successors)
+        arrays["good_ptr"], arrays["good_ids"] = to_csr(good)
+        arrays["mistake_ptr"], arrays["mistake_ids"] = to_csr(mistakes)
+        return arrays
+
+    def save(self, path):
+        """ Stores the arrays of the table as .npy files in directory path, such that they can be memory-mapped """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        for name, array in self.arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+        with open(os.path.join(tmp_path, "rules.json"), "w") as f:
+            json.dump(rules(self.symmetric), f)
+
+        try:
+            os.replace(tmp_path, path)  # atomic, concurrent writers produce the same table
+        except OSError:
+            for name in os.listdir(tmp_path):
+                os.remove(os.path.join(tmp_path, name))
+            os.rmdir(tmp_path)
+
+    @staticmethod
+    def load(path, mmap_mode="r"):
+        """ Loads a table stored by save, the arrays are memory-mapped unless mmap_mode is None """
+        with open(os.path.join(path, "rules.json")) as f:
+            if json.load(f) not in [rules(False), rules(True)]:
+                raise Exception(f"Cached state table {path} was built with other rules")
+
+        arrays = {name[:-len(".npy")]: np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+                  for name in os.listdir(path) if name.endswith(".npy")}
+        return StateTable(arrays)
+
+    def lookup(self, board):
+        """ Returns the id of the (stored) board, None if it is not in the table """
+        board = tuple(board)
+        i = self.__ids.get(board)
+        if i is None:
+            if len(board) != SIZE or any(field not in (EMPTY, X, O) for field in board):
+                self.__ids[board] = -1  # not a board, its base-3 code would be that of another board
+                return None
+            code = int(encode([board])[0])
+            position = np.searchsorted(self.sorted_codes, code)
+            found = position < len(self.sorted_codes) and self.sorted_codes[position] == code
+            i = self.__ids[board] = int(self.code_order[position]) if found else -1  # -1: not in the table
+        return i if i >= 0 else None
+
+    def id(self, board):
+        board = tuple(board)
+        i = self.__ids.get(board)
+        if i is not None and i >= 0:
+            return i
+        i = self.lookup(board)
+        if i is None and self.symmetric and len(board) == SIZE:
+            i = self.lookup(ClassicalBoard.Board.canonical(board))
+        if i is None:
+            raise KeyError(board)
+        return i
+
+    def next_boards(self, board):
+        """ Returns the set of boards which follow board """
+        return {self.boards[j] for j in self.successors[self.id(board)]}
+
+    def good_boards(self, board):
+        """ Returns the list of boards which follow board without changing its win-state """
+        return self.__successor_boards(self.__good_boards, self.good_successors, board)
+
+    def mistake_boards(self, board):
+        """ Returns the list of boards to which a mistake on board can lead """
+        return self.__successor_boards(self.__mistake_boards, self.mistake_successors, board)
+
+    def __successor_boards(self, decoded, successors, board):
+        # the boards of a row of successors, decoded once per process (the lists are shared, not to be changed)
+        boards = decoded.get(board)
+        if boards is None:
+            boards = decoded[board] = [self.boards[j] for j in successors[self.id(board)]]
+        return boards
+
+    def pick(self, kind, states, rng):
+        """ Picks for every id in the array states a uniformly random id out of its successors of kind 'successor',
+        'good' or 'mistake' """
+        return self.choose(kind, states, rng.random(len(states)))
+
+    def choose(self, kind, states, uniforms):
+        """ pick with the given uniform random numbers in [0, 1), one for every id in states """
+        ptr, ids = self.arrays[f"{kind}_ptr"], self.arrays[f"{kind}_ids"]
+        start = ptr[states]
+        count = ptr[states + 1] - start
+        return ids[start + (uniforms * count).astype(np.int64)].astype(np.int64)
+
+    def mask(self, boards):
+        """ Returns a boolean array over the ids which is True for the boards in the (unchanging) set boards """
+        if id(boards) not in self.__masks or self.__masks[id(boards)][0] is not boards:
+            self.__masks[id(boards)] = (boards, np.fromiter((board in boards for board in self.boards), dtype=bool, count=len(self)))
+        return self.__masks[id(boards)][1]
+
+
+def encode(boards):
+    """ Packs boards into their base-3 codes """
+    return np.array(boards, dtype=np.int64).reshape(-1, SIZE) @ (3 ** np.arange(SIZE, dtype=np.int64))
+
+def decode(codes):
+    """ Unpacks base-3 codes into an array of boards """
+    return (np.asarray(codes, dtype=np.int64)[:, None] // (3 ** np.arange(SIZE, dtype=np.int64))) % 3
+
+class Boards(Sequence):
+    """ The boards (tuple repr) of the base-3 codes, decoded on access """
+    def __init__(self, codes):
+        self.codes = codes
+        self.__decoded = {}  # id -> board, of the boards accessed by this process
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        board = self.__decoded.get(i)
+        if board is None:
+            board = self.__decoded[i] = tuple(decode([self.codes[i]])[0].tolist())
+        return board
+
+    def __iter__(self):
+        # decodes in blocks, which is much faster than board by board
+        for start in range(0, len(self.codes), 4096):
+            yield from map(tuple, decode(self.codes[start:start + 4096]).tolist())
+
+
+class Successors(Sequence):
+    """ id -> tuple of the ids of row id of the CSR arrays ptr, ids, unpacked on access """
+    def __init__(self, ptr, ids):
+        self.ptr = ptr
+        self.ids = ids
+        self.__unpacked = {}  # id -> tuple of ids, of the rows accessed by this process
+
+    def __len__(self):
+        return len(self.ptr) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        row = self.__unpacked.get(i)
+        if row is None:
+            j = i + len(self) if i < 0 else i
+            row = self.__unpacked[i] = tuple(self.ids[self.ptr[j]:self.ptr[j + 1]].tolist())
+        return row
+
+
+def to_csr(rows):
+    """ Packs a list of tuples of ids into an array of row offsets and an array of ids """
+    ptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    ptr[1:] = np.cumsum([len(row) for row in rows])
+    return ptr, np.array([j for row in rows for j in row], dtype=np.int32)
+
+def rules(symmetric=SYMMETRIC):
+    """ The parameters which determine the contents of the state table """
+    return {"version": CACHE_VERSION, "rows": ROWS, "cols": COLS, "k": K, "symmetric": symmetric, 
+            "empty": EMPTY, "x": X, "o": O}
+
+def cache_path():
+    """ The cache directory of the state table, keyed by the rules such that a change in rules invalidates it """
+    key = hashlib.sha1(json.dumps(rules(), sort_keys=True).encode()).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, f"states-{key}")
+
+
+__table = None
+
+def get_table():
+    """ Returns the state table, loading it from the cache or building (and caching) it on first use """
+    global __table
+    if __table is None:
+        path = cache_path()
+        if os.path.isdir(path):
+            __table = StateTable.load(path)
+        else:
+            __table = StateTable()
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                __table.save(path)
+            except OSError:
+                pass  # the cache is an optimization only
+    return __table
@@ -0,0 +1,31 @@
+import numpy as np
+from constants import *
+from StateTable import get_table
+from strategy import ClassicalStrategy
+from profiling import timed
+
+
+def supports(strategy_pair):
+    """ Returns whether the games of strategy_pair can be played by the batch engine """
+    return all(isinstance(strategy, ClassicalStrategy) for strategy in strategy_pair)
+
+
+@timed
+def play_classical_batch(strategy_pair, M, n_games, rng):
+    """
+    Plays n_games games of two classical strategies (e.g. ClassicalWithoutMistakes against ClassicalWithMistakes) at
+    once and returns the number of wins {X, O, T}. The games are held as an array of board ids which is advanced a ply
+    at a time by lookups in the successor and mistake arrays of the state table, with all coin flips and choices drawn
+    in batches from rng.
+    """
+    if not supports(strategy_pair):
+        raise Exception(f"Batch engine can not play {strategy_pair}")
+
+    table = get_table()
+
+    states = np.full(n_games, table.id(tuple((EMPTY for _ in range(SIZE)))), dtype=np.int64)
+    for move in range(SIZE):  # the last move (move == SIZE) leaves the board as is
+        states = strategy_pair[(move + M) % 2].classical_next_states(states, rng)
+
+    winners = table.winner[states]
+    return {W: int(np.count_nonzero(winners == W)) for W in [X, O, T]}
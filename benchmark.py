@@ -0,0 +1,130 @@
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+from constants import *
+from ClassicalBoard import Board
+from QuantumBoard import QuBoard, DenseQuBoard, amplify_batch
+from StateTable import StateTable
+from strategy import *
+import main
+import sweep
+
+
+def measure(func, min_time=0.2):
+    """ Returns the number of calls of func per second, and the peak memory (bytes) allocated during one call """
+    func()  # warm up, e.g. building the state table
+    calls, start = 0, time.perf_counter()
+    while time.perf_counter() - start < min_time:
+        func()
+        calls += 1
+    ops_per_sec = calls / (time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return ops_per_sec, peak
+
+
+def benchmarks():
+    """ Returns the benchmarks {name: (function, number of games played by one call)} """
+    B_T, B_X, B_O, E = main.categorize_boards()
+    strategies = [cls(B_X, B_O, B_T, E) for cls in [ClassicalWithoutMistakes, ClassicalWithMistakes, QuantumEqualSuperposition,
+                                                    QuantumEndAmplification, QuantumFullAmplification]]
+    strategies[1].set_mistake_prob(0.3)
+
+    board = (X,O,0,
+             0,X,0,
+             0,0,0)
+    board_obj = Board(board)
+
+    # a superposition two moves into a game, on which the strategies move and which is amplified and measured
+    decomp = QuBoard()
+    for move in range(2):
+        decomp, _ = strategies[2].next_move(decomp, dict(), move)
+    decomp = decomp.get_decomp()
+
+    cases = {
+        "Board.has_winner": (lambda: Board.has_winner(board), 0),
+        "Board.is_valid": (lambda: Board.is_valid(list(board)), 0),
+        "Board.get_next_boards": (lambda: board_obj.get_next_boards(), 0),
+        "categorize_boards": (main.categorize_boards, 0),
+        "categorize_boards (uncached)": (lambda: StateTable(), 0),
+    }
+    for strategy in strategies:
+        for backend in [QuBoard, DenseQuBoard]:
+            cases[f"{strategy.__class__.__name__}.next_move[{backend.__name__}]"] = \
+                (lambda strategy=strategy, backend=backend: strategy.next_move(backend(dict(decomp)), PolicyMemo(), 2), 0)
+    for backend in [QuBoard, DenseQuBoard]:
+        cases[f"{backend.__name__}.amplify"] = (lambda backend=backend: backend(dict(decomp)).amplify(B_X), 0)
+        cases[f"{backend.__name__}.measure"] = (lambda backend=backend: backend(dict(decomp)).measure(), 0)
+    probs = np.tile(DenseQuBoard(dict(decomp)).get_probs(), (1000, 1))
+    good = strategies[0].table.mask(B_X)
+    cases["amplify_batch (1000 superpositions)"] = (lambda: amplify_batch(probs, good), 0)
+
+    # a sweep over all pairings of the thesis, both orders and two mistake probabilities with 10 games per cell
+    pair_classes = [(ClassicalWithoutMistakes, ClassicalWithMistakes), (QuantumEqualSuperposition, ClassicalWithMistakes),
+                    (QuantumEndAmplification, ClassicalWithMistakes), (QuantumFullAmplification, ClassicalWithMistakes)]
+    cells = [(pair_index, M, prob_index, prob, 0, 10, 0, None)
+             for pair_index in range(len(pair_classes)) for M in [X, O] for prob_index, prob in enumerate([0, 0.5])]
+    sweep.init_worker((B_T, B_X, B_O, E), pair_classes)
+    cases["mini-sweep"] = (lambda: [sweep.run_cell(cell) for cell in cells], 10 * len(cells))
+
+    return cases
+
+
+def compare(results, baseline, threshold):
+    """ Returns the names of the benchmarks which are more than threshold (a fraction) slower than the baseline """
+    return [name for name in results if name in baseline
+            and results[name]["ops_per_sec"] < baseline[name]["ops_per_sec"] * (1 - threshold)]
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Benchmarks the hot paths of the simulations")
+    parser.add_argument("--output", default="benchmark_results.json", help="file the results are written to")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="file with the results to compare to")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed fraction of slow down")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds each benchmark is repeated")
+    args = parser.parse_args()
+
+    results = dict()
+    print(f"{'benchmark':<55} {'ops/sec':>12} {'games/sec':>10} {'peak memory':>12}")
+    for name, (func, games) in benchmarks().items():
+        ops_per_sec, peak = measure(func, args.min_time)
+        results[name] = {"ops_per_sec": ops_per_sec, "games_per_sec": ops_per_sec * games, "peak_memory": peak}
+        print(f"{name:<55} {ops_per_sec:>12.1f} {ops_per_sec * games:>10.1f} {peak / 1024:>9.1f} KiB")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        return 0
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"No baseline {args.baseline} to compare to, store one with --save-baseline")
+        return 0
+
+    for name in results:
+        if name in baseline:
+            change = results[name]["ops_per_sec"] / baseline[name]["ops_per_sec"] - 1
+            print(f"{name:<55} {change:>+8.1%}")
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"Regressions of more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -1 +1,9 @@
-EMPTY, T, O, X, SIZE = 0, 0, 1, 2, 9
\ No newline at end of file
+from os import environ as _environ
+
+# the game is played on a ROWS x COLS board on which K markings in a line win (m,n,k-game), set by the environment
+ROWS = int(_environ.get("TTT_ROWS", 3))
+COLS = int(_environ.get("TTT_COLS", 3))
+K = int(_environ.get("TTT_K", 3))
+SYMMETRIC = _environ.get("TTT_SYMMETRIC", "0") == "1"  # only store one board of every class of symmetric boards
+
+EMPTY, T, O, X, SIZE = 0, 0, 1, 2, ROWS * COLS
@@ -0,0 +1,147 @@
+from collections import Counter
+from math import sqrt
+import numpy as np
+from ClassicalBoard import Board
+from QuantumBoard import QuBoard, DenseQuBoard
+from constants import *
+from strategy import PolicyMemo, ClassicalStrategy, CommonRandomNumbers
+from profiling import timed
+
+
+@timed
+def play_game(strategy_pair, M, backend=QuBoard, prior_mappings=None, pruning=None):
+    """ Plays a single game in which strategy_pair[0] plays X iff M == X, returns the final superposition. The
+    superposition is stored by backend, QuBoard or DenseQuBoard, and the chosen moves in the PolicyMemo 
+    prior_mappings, which is reset first. With a Pruning pruning the superposition is pruned after every move """
+    if prior_mappings is None:
+        prior_mappings = PolicyMemo()
+    prior_mappings.reset()
+    board = backend()
+    if pruning is not None:
+        pruning.games += 1
+
+    for move in range(SIZE + 1):
+        board, prior_mappings = strategy_pair[(move + M) % 2].next_move(board, prior_mappings, move)
+        if pruning is not None:
+            pruning(board, move)
+
+    return board
+
+
+def deterministic(strategy_pair, M, move):
+    """ Whether the move is made without random choices, i.e. by a quantum strategy or the final (empty) move """
+    return move == SIZE or not isinstance(strategy_pair[(move + M) % 2], ClassicalStrategy)
+
+
+@timed
+def play_cached_game(strategy_pair, M, cache):
+    """
+    play_game on the DenseQuBoard backend which continues from the superpositions of earlier games in the
+    SuperpositionCache cache. The classical strategies make all their decisions as in play_game (drawing the same
+    random numbers, so the results are the same), the moves of the deterministic (quantum) strategies which follow 
+    decisions made before are looked up instead. The cache holds the games of one strategy_pair, M and mistake prob.
+    """
+    decisions, board, move = (), DenseQuBoard(), 0
+    while True:
+        cached = cache.get(decisions)
+        if cached is None:
+            # the moves until the next decision of a classical strategy, from a superposition not in the cache
+            while move <= SIZE and deterministic(strategy_pair, M, move):
+                board, _ = strategy_pair[(move + M) % 2].next_move(board, None, move)
+                move += 1
+            cache[decisions] = (board, move)
+        else:
+            board, move = cached
+
+        if move > SIZE:
+            return DenseQuBoard.trusted(board.get_probs())  # a new board, measuring it leaves the cached board as is
+
+        board, next_states = strategy_pair[(move + M) % 2].dense_next_move(board)
+        decisions += (next_states.tobytes(),)
+        move += 1
+
+
+@timed
+def play_coupled_game(strategy_pair, M, probs, crn):
+    """
+    Plays a game for every mistake probability of the array probs at once, with the CommonRandomNumbers crn (which the
+    strategies of strategy_pair must use). A mistake is made on a board iff its number of crn is below the mistake
+    probability, so the games of all probabilities are the same until a classical strategy with mistakes decides on a
+    board whose number lies between them. There the probabilities are split by these thresholds and every group
+    continues with its own superposition. Returns the winner of the game of every probability, the same winners as
+    play_game on the DenseQuBoard backend with the same crn for every probability separately.
+    """
+    winners = np.empty(len(probs), dtype=np.int8)
+    stack = [(DenseQuBoard(), 0, np.arange(len(probs)))]  # (superposition, move, indices of the probabilities)
+    while stack:
+        board, move, indices = stack.pop()
+        while move <= SIZE and deterministic(strategy_pair, M, move):
+            board, _ = strategy_pair[(move + M) % 2].next_move(board, None, move)
+            move += 1
+
+        if move > SIZE:
+            winners[indices] = evaluate(board, crn)
+            continue
+
+        # the probabilities which make the same mistakes, those between the same thresholds, make the same move
+        strategy = strategy_pair[(move + M) % 2]
+        thresholds = np.unique(strategy.policy.mistake_uniforms(np.flatnonzero(board.get_probs()), crn))
+        groups = np.searchsorted(thresholds, probs[indices], side="left")
+        for group in np.unique(groups):
+            group_indices = indices[groups == group]
+            if strategy.policy.mistakes:
+                strategy.set_mistake_prob(probs[group_indices[0]])
+            next_board, _ = strategy.dense_next_move(board)
+            stack.append((next_board, move + 1, group_indices))
+
+    return winners
+
+
+@timed
+def evaluate(quboard: QuBoard, rng=None):
+    # measure the final super position, CommonRandomNumbers hold a number of their own for it which all games share
+    board = quboard.measure(rng, rng.measurement if isinstance(rng, CommonRandomNumbers) else None)
+
+    # determine the winner
+    w_n, w = Board.has_winner(board.get_board())
+    if w_n == 1:
+        return w
+    return T
+
+
+def sample_outcomes(quboard, k, rng=None):
+    """ Returns the numbers of wins {X, O, T} of k measurements of the final superposition quboard, drawn without
+    collapsing it. The measurements share the random choices made during the game, unlike k games. """
+    wins = {X: 0, O: 0, T: 0}
+    for board, count in Counter(board.get_board() for board in quboard.sample(k, rng)).items():
+        w_n, w = Board.has_winner(board)
+        wins[w if w_n == 1 else T] += count
+    return wins
+
+
+def outcome_distribution(quboard):
+    """ Returns the probabilities {X, O, T} of the winners upon measuring quboard """
+    outcome = {X: 0, O: 0, T: 0}
+    for board, prob in quboard.get_decomp().items():
+        w_n, w = Board.has_winner(board)
+        outcome[w if w_n == 1 else T] += prob
+    return outcome
+
+
+@timed
+def exact_outcome(strategy_pair, M):
+    """
+    Returns the exact probabilities {X, O, T} of the winners of a game in which strategy_pair[0] plays X iff M == X. 
+    Instead of sampling games the full distribution is propagated, with the random choices (and mistakes) of a 
+    classical strategy as a probability weighted mixture. This requires the strategies to be linear.
+    """
+    board = DenseQuBoard()
+    for move in range(SIZE):  # the last move leaves the board as is
+        board = DenseQuBoard.trusted(strategy_pair[(move + M) % 2].expected_transition().apply(board.get_probs()))
+
+    return outcome_distribution(board)
+
+
+def binomial_results(outcome, iterations):
+    """ Returns the mean and std {X, O, T} of the number of wins in [iterations] games with outcome probabilities """
+    return {W: (iterations * outcome[W], sqrt(max(iterations * outcome[W] * (1 - outcome[W]), 0))) for W in [X, O, T]}
@@ -1,87 +1,50 @@
-from collections import Counter
-from functools import reduce
-from itertools import permutations, product
-from math import ceil, floor, sqrt
-from random import random, choice
+import json
+from itertools import product
 from ClassicalBoard import Board
-from QuantumBoard import QuBoard
+from QuantumBoard import QuBoard, DenseQuBoard
+from StateTable import get_table
+from game import *
+from sweep import sweep_cells, coupled_cells, refine_grid, tournament_cells, cell_mode
+from resultStream import (ResultWriter, completed_cells, cell_key, aggregate, paired_summary, pruning_summary,
+                          EXACT, TOURNAMENT, COUPLED)
+from resultCache import ResultCache
 from constants import *
 from helperFunctions import *
-import matplotlib.pyplot as plt
-from matplotlib import cm
 from typing import Dict, Set
 from strategy import *
 import numpy as np
-from tqdm import tqdm
+import profiling
+from profiling import timed
 
 
+@timed
 def categorize_boards():
-    # In this function all possible Tic tac toe boards are categorized in the set B_X, B_O, B_T and C
-    recorded_boards: Dict[tuple[int], int] = {}  # dictionary; key: board (tuple repr), value win-state X,O,T
-
-    # For each number of moves left determine for all board their win-state. This allows for determining win-state
-    # in an inductive manner.
-    for num_moves_left in range(10):
-        # set of all possible boards made with the correct number of moves
-        all_board_permutations = set(permutations([2]*ceil((9-num_moves_left)/2) + [1]*floor(((9-num_moves_left)/2)) + [0]*num_moves_left))
-
-        for board in all_board_permutations:
-            if not Board.is_valid(board):
-                continue
-
-            num_winners, winner = Board.has_winner(board)
-            if num_moves_left == 0:  # this is a filled board
-                # no more moves can be made, so the win-state is determined by winner
-                recorded_boards[board] = winner
-            elif num_winners == 1:  # there is a premature winner
-                recorded_boards[board] = winner
-            else:  
-                board_obj = Board(board)  # make a board class version of the board tuple
-                player_to_move = board_obj.player_to_move()
-                preferred_win_state = O if player_to_move == X else X
-
-                possible_moves = board_obj.get_next_boards()
-                for move in possible_moves:
-                    # update the best recorded win-state
-                    preferred_win_state = state_max([preferred_win_state, recorded_boards[move]], player_to_move)
-                
-                recorded_boards[board] = preferred_win_state
-
-    # categorizing the following sets by their recorded win-states
-    B_X: Set[tuple[int]] = set(filter(lambda x: recorded_boards[x] == X, recorded_boards))
-    B_O: Set[tuple[int]] = set(filter(lambda x: recorded_boards[x] == O, recorded_boards))
-    B_T: Set[tuple[int]] = set(filter(lambda x: recorded_boards[x] == T, recorded_boards))
-    
-    C: Dict[tuple[int], Set[tuple[int]]] = dict()  # key: board upon which a mistake can be made, value: set of boards to which a mistake can lead
-    for board in B_T:
-        board_obj = Board(board)
-        num_moves_left = Counter(board)[0]
-        player_to_move = board_obj.player_to_move()
-        other_player = X if player_to_move == O else O
-
-        possible_mistakes = set(filter(lambda x: recorded_boards[x] == other_player, board_obj.get_next_boards()))
-        for mistake in possible_mistakes:
-            if board in C.keys():
-                C[board].add(mistake)
-            else:
-                C[board] = {mistake}
+    # In this function all possible Tic tac toe boards are categorized in the set B_X, B_O, B_T and C. Only the
+    # reachable boards are enumerated (forward from the empty board) and their win-states are determined by
+    # retrograde analysis from the filled and won boards, see StateTable.
+    table = get_table()
+
+    # categorizing the following sets by their win-states
+    B_X: Set[tuple[int]] = {board for board, win_class in zip(table.boards, table.win_class) if win_class == X}
+    B_O: Set[tuple[int]] = {board for board, win_class in zip(table.boards, table.win_class) if win_class == O}
+    B_T: Set[tuple[int]] = {board for board, win_class in zip(table.boards, table.win_class) if win_class == T}
+
+    # key: board upon which a mistake can be made, value: set of boards to which a mistake can lead
+    C: Dict[tuple[int], Set[tuple[int]]] = {board: set(table.mistake_boards(board)) 
+                                            for board, mistakes in zip(table.boards, table.mistake_successors) if mistakes}
     
     return B_T, B_X, B_O, C
 
 
-def evaluate(quboard: QuBoard):
-    # measure the final super position
-    board = quboard.measure()
+@timed
+def visualize(results, path=None):
+    # plotting the results, to the file path (headless) or in a window if path is None. matplotlib is only imported
+    # when plotting, which keeps the import of the simulations light
+    import matplotlib
+    if path is not None:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
 
-    # determine the winner
-    w_n, w = Board.has_winner(board.get_board())
-    if w_n == 1:
-        return w
-    return T
-
-
-def visualize(results):
-    # plotting the results
     fig, axs = plt.subplots(1, 2, figsize=(12, 5), sharex=True, sharey=True)
 
     for i, m_val in enumerate([O, X]):
@@ -121,69 +84,262 @@ def visualize(results):
         ax.grid(True)
 
     plt.tight_layout()
-    plt.show()
-
-
-def main():
+    if path is None:
+        plt.show()
+    else:
+        fig.savefig(path)
+        plt.close(fig)
+
+
+STRATEGIES = {cls.__name__: cls for cls in [ClassicalWithoutMistakes, ClassicalWithMistakes, QuantumEqualSuperposition,
+                                            QuantumEndAmplification, QuantumFullAmplification]}
+
+# the simulation specification of the thesis, a spec file (see load_spec) overrides any of these
+DEFAULT_SPEC = {
+    "num_runs": 5,
+    "iterations": 350,
+    "delta": 0.01,  # step of the grid of mistake probabilities, unless the probabilities p are given
+    "p": None,
+    "orders": ["X", "O"],  # the symbols (values of M) played by the first strategy of a pair
+    "strategy_pairs": [
+        ["ClassicalWithoutMistakes", "ClassicalWithMistakes"],
+        ["QuantumEqualSuperposition", "ClassicalWithMistakes"],
+        ["QuantumEndAmplification", "ClassicalWithMistakes"],
+        ["QuantumFullAmplification", "ClassicalWithMistakes"],
+    ],
+    "exact": True,  # compute the results of pairs of linear strategies exactly instead of by simulation
+    "seed": 0,  # the results of a sweep are determined by its seed
+    "workers": None,  # number of processes the simulations are run on, None uses all cores
+    "stream": "results.jsonl",  # file the results of the cells are streamed to
+    # None plays [num_runs] runs of [iterations] games per cell, [target standard error of the tie rate, games per
+    # batch, max games per cell], e.g. [0.01, 50, 5000], plays batches per cell until the tie rate is that precise
+    "sampling": None,
+    # None evaluates every probability of p, [coarse step, tolerance], e.g. [10, 5], starts with every [coarse step]th
+    # probability and bisects where a curve deviates more than tolerance ties from a straight line or curves cross
+    "grid": None,
+    # plays all pairs (also the linear ones) as a tournament with common random numbers and reports the differences of
+    # their tie rates to those of the first pair, paired per game (see sweep.run_tournament_cell)
+    "tournament": False,
+    # plays every game once for all probabilities p, the mistakes of a probability are those of which the common
+    # random number is below it (see game.play_coupled_game)
+    "coupled": False,
+    # reuses the results of cells computed by earlier sweeps with the same strategies, see resultCache (not used by a
+    # tournament, whose pairs depend on each other)
+    "cache": True,
+    # None plays exact superpositions, [threshold, top_k], e.g. [0.001, null], prunes the superpositions of the
+    # simulated games after every move (see QuBoard.prune) and reports the discarded probability of every cell
+    "pruning": None,
+    "plot": "show",  # "show" plots in a window, a file name renders the plot to that file, None does not plot
+}
+
+
+def load_spec(path=None):
+    """ Returns the simulation specification of the JSON or TOML file path (the default spec if None), missing
+    entries are taken from DEFAULT_SPEC """
+    spec = dict(DEFAULT_SPEC)
+    if path is None:
+        return spec
+
+    with open(path, "rb") as f:
+        if path.endswith(".toml"):
+            import tomllib
+            overrides = tomllib.load(f)
+        else:
+            overrides = json.load(f)
+    unknown = overrides.keys() - spec.keys()
+    if unknown:
+        raise Exception(f"Unknown entries {sorted(unknown)} in spec {path}")
+    spec.update(overrides)
+    check_sampling(spec["sampling"])
+    return spec
+
+
+def check_sampling(sampling):
+    """ Raises an Exception unless sampling is None or a valid (target_se, batch_size, max_games) """
+    if sampling is None:
+        return
+    if len(sampling) != 3:
+        raise Exception(f"sampling {list(sampling)} is not [target_se, batch_size, max_games]")
+    target_se, batch_size, max_games = sampling
+    if not target_se > 0:
+        raise Exception(f"The target_se of sampling {list(sampling)} is not positive")
+    if not all(isinstance(n, int) and n > 0 for n in [batch_size, max_games]) or max_games < batch_size:
+        raise Exception(f"The batch_size and max_games of sampling {list(sampling)} are not positive ints with "
+                        f"max_games >= batch_size")
+
+
+def report_tournament(stream):
+    # the mean paired difference of the tie rate of every pair to the first pair per order, with its standard error
+    # and the standard error of independent games, averaged over the probabilities
+    summary = dict()
+    for (pair, reference, M, prob), errors in paired_summary(stream).items():
+        if pair != reference:
+            summary.setdefault((pair, M), []).append(errors)
+
+    print(f"{'pair':<70} {'M':>2} {'tie rate diff':>14} {'paired se':>10} {'indep. se':>10}")
+    for (pair, M), errors in summary.items():
+        mean, paired_se, independent_se = np.mean(errors, axis=0)
+        print(f"{pair:<70} {'X' if M == X else 'O':>2} {mean:>14.4f} {paired_se:>10.4f} {independent_se:>10.4f}")
+
+
+def report_pruning(stream, cells):
+    # the mean discarded probability per game and per ply of the pruned games of every cell of the sweep
+    print(f"{'pair':<70} {'M':>2} {'prob':>6} {'games':>7} {'discarded':>10}  per ply")
+    for (pair, M, prob), (games, per_ply) in sorted(pruning_summary(stream, cells).items()):
+        print(f"{pair:<70} {'X' if M == X else 'O':>2} {prob:>6.3f} {games:>7} {sum(per_ply):>10.4f}  "
+              + " ".join(f"{discarded:.3f}" for discarded in per_ply))
+
+
+def main(spec=None):
     # simulation specification
-    num_runs = 5
-    iterations = 350
-    delta = 0.01
-    p = [delta*i for i in range(0, int(1/delta)+1)]
+    spec = load_spec() if spec is None else spec
+    num_runs, iterations, seed, workers, stream = spec["num_runs"], spec["iterations"], spec["seed"], spec["workers"], spec["stream"]
+    delta = spec["delta"]
+    p = spec["p"] if spec["p"] is not None else [delta*i for i in range(0, int(1/delta)+1)]
+    orders = [{"X": X, "O": O}[order] for order in spec["orders"]]
+    sampling = tuple(spec["sampling"]) if spec["sampling"] is not None else None
+    check_sampling(sampling)
+    grid = spec["grid"]
+    if spec["tournament"] and (sampling is not None or grid is not None):
+        raise Exception("A tournament plays every cell in full, it does not support sampling or grid")
+    if spec["coupled"] and (sampling is not None or grid is not None or spec["tournament"]):
+        raise Exception("A coupled sweep plays all probabilities at once, it does not support sampling, grid or tournament")
+    pruning = tuple(spec["pruning"]) if spec["pruning"] is not None else None
+    if pruning is not None and (spec["coupled"] or spec["tournament"]):
+        raise Exception("Pruning is only supported by the sweep of independent cells")
+
+    profiling.start()  # opt-in by TTT_PROFILE=1 (and TTT_PROFILE_DUMP=<file> for cProfile stats)
 
     # Categorize all the boards in the sets B_X, B_O, B_T and E
     B_T, B_X, B_O, E = categorize_boards()
     print(f"|B_X| = {len(B_X)}, |B_O| = {len(B_O)}, |B_T| = {len(B_T)}, |E| = {len(E)}")
 
-    # Initialize Strategies
-    classical_without_mistakes = ClassicalWithoutMistakes(B_X, B_O, B_T, E)
-    classical_with_mistakes = ClassicalWithMistakes(B_X, B_O, B_T, E)
-    quantum_equal_superposition = QuantumEqualSuperposition(B_X, B_O, B_T, E)
-    quantum_with_end_amplification = QuantumEndAmplification(B_X, B_O, B_T, E)
-    quantum_with_full_amplification = QuantumFullAmplification(B_X, B_O, B_T, E)
+    # Initialize Strategies, one of every class which is shared by the pairs
+    strategies = {name: STRATEGIES[name](B_X, B_O, B_T, E) for pair in spec["strategy_pairs"] for name in pair}
 
     # play game with certain strategy pairings
-    strategy_pairs = [
-        (classical_without_mistakes, classical_with_mistakes),
-        (quantum_equal_superposition, classical_with_mistakes),
-        (quantum_with_end_amplification, classical_with_mistakes),
-        (quantum_with_full_amplification, classical_with_mistakes),
-    ]
-
-    results_list = []
-
-    for _ in range(num_runs):
-        results = dict()
-
-        total = len(strategy_pairs) * 2 * len(p) * iterations
-        for strategy_pair, M, prob, i in tqdm(product(strategy_pairs, [X, O], p, range(iterations)), total=total, desc="Running simulations..."):
-            # we iterate over the strategy pairs, the player order, prob of making a mistake, all [iterations] number of times.
-            if i == 0:
-                results[(strategy_pair, M, prob)] = {X: 0, O: 0, T: 0}
-            
-            board = QuBoard()
-            prior_mappings = dict()
-
-            # updating strategy variables
-            classical_with_mistakes.set_mistake_prob(p=prob)
-            for move in range(10):
-                board, prior_mappings = strategy_pair[(move + M) % 2].next_move(board, prior_mappings, move)
-
-            winner = evaluate(board)
-            results[(strategy_pair, M, prob)][winner] += 1
-
-        results_list.append(results)
-
-    combined_results = dict()
-    all_keys = set()
-    for result in results_list:
-        all_keys.update(result.keys())
-    for key in all_keys:
-        print(key)
-        combined_results[key] = {M: (np.mean([results[key][M] for results in results_list]), 
-                                     np.std([results[key][M] for results in results_list])) for M in [X, O, T]}
-
-    visualize(combined_results)
+    strategy_pairs = [tuple(strategies[name] for name in pair) for pair in spec["strategy_pairs"]]
+
+    # the results of the exactly evaluated pairs are the binomial distributions of the exact outcome probabilities
+    exact_pairs = [strategy_pair for strategy_pair in strategy_pairs 
+                   if spec["exact"] and not spec["tournament"] and all(s.linear for s in strategy_pair)]
+    strategy_pairs = [strategy_pair for strategy_pair in strategy_pairs if strategy_pair not in exact_pairs]
+
+    # every finished cell is appended to the result stream, cells already in the stream (of an interrupted sweep with
+    # the same specification) are skipped on restart
+    completed = completed_cells(stream)
+    cache = ResultCache() if spec["cache"] and not spec["tournament"] else None
+    runs = range(1) if sampling is not None else range(num_runs)
+
+    def mode(strategy_pair):
+        # how the simulated cells of strategy_pair are played, cells of different modes are different cells
+        return TOURNAMENT if spec["tournament"] else COUPLED if spec["coupled"] else cell_mode(strategy_pair, sampling, pruning)
+
+    def stream_key(strategy_pair, M, prob, run):
+        # the key of a cell of this spec in the stream, see resultStream.cell_key
+        if strategy_pair in exact_pairs:
+            return str(strategy_pair), M, prob, None, iterations, None, EXACT
+        return str(strategy_pair), M, prob, run, iterations, seed, mode(strategy_pair)
+
+    # the keys of the cells of this spec, a stream may also hold the cells of other specs
+    spec_cells = {stream_key(strategy_pair, M, prob, None) for strategy_pair, M, prob in product(exact_pairs, orders, p)}
+    spec_cells |= {stream_key(strategy_pair, M, prob, run) for strategy_pair, M, prob, run in product(strategy_pairs, orders, p, runs)}
+
+    def cache_key(strategy_pair, M, i, run):
+        # the cells of the exact pairs do not depend on the run and seed, the simulated cells are seeded by the index
+        # of their pair and probability (see sweep.cell_rng). So only pairs appended to the spec reuse the cached
+        # cells of the other pairs, inserting or reordering pairs computes the cells of the pairs behind them again
+        if strategy_pair in exact_pairs:
+            return cache.key(strategy_pair, M=M, prob=p[i], iterations=iterations, exact=True)
+        return cache.key(strategy_pair, M=M, prob=p[i], iterations=iterations, seed=seed, run=run, mode=mode(strategy_pair),
+                         pair_index=strategy_pairs.index(strategy_pair), prob_index=i)
+
+    with ResultWriter(stream) as writer:
+        def evaluate_probs(prob_indices):
+            # plays the cells of the probabilities p[i] for i in prob_indices, returns the results in the stream
+            if cache is not None:
+                # the cells which are not in the stream yet are copied from the cache if they were computed before
+                cells = list(product(exact_pairs, orders, prob_indices, [None])) + list(product(strategy_pairs, orders, prob_indices, runs))
+                for strategy_pair, M, i, run in cells:
+                    record = cache.get(cache_key(strategy_pair, M, i, run)) if stream_key(strategy_pair, M, p[i], run) not in completed else None
+                    if record is not None:
+                        completed.add(cell_key(writer.write(record)))
+
+            with profiling.phase("main: exact pairs"):
+                for strategy_pair, M, i in product(exact_pairs, orders, prob_indices):
+                    if stream_key(strategy_pair, M, p[i], None) not in completed:
+                        for strategy in strategy_pair:
+                            if isinstance(strategy, ClassicalWithMistakes):
+                                strategy.set_mistake_prob(p=p[i])
+                        record = writer.write_exact(strategy_pair, M, p[i], iterations, exact_outcome(strategy_pair, M))
+                        if cache is not None:
+                            cache[cache_key(strategy_pair, M, i, None)] = record
+
+            # the wall time of the sweep, the time spent in the workers is included in their timers
+            with profiling.phase("main: sweep"):
+                if spec["coupled"]:
+                    cells = ((*cell, None) for cell in coupled_cells(strategy_pairs, (B_T, B_X, B_O, E), orders, p, iterations,
+                                                                     num_runs, seed=seed, workers=workers, skip=completed))
+                else:
+                    cells = sweep_cells(strategy_pairs, (B_T, B_X, B_O, E), orders, p, iterations, num_runs, seed=seed, 
+                                        workers=workers, skip=completed, sampling=sampling, prob_indices=prob_indices,
+                                        pruning=pruning)
+                for strategy_pair, M, prob, run, wins, pruned in cells:
+                    record = writer.write_cell(strategy_pair, M, prob, run, iterations, seed, wins, mode(strategy_pair), pruned)
+                    if cache is not None:
+                        cache[cache_key(strategy_pair, M, p.index(prob), run)] = record
+            return aggregate(stream, spec_cells)
+
+        if spec["tournament"]:
+            with profiling.phase("main: tournament"):
+                cells = tournament_cells(strategy_pairs, (B_T, B_X, B_O, E), orders, p, iterations, num_runs, seed=seed,
+                                         workers=workers, skip=completed)
+                for strategy_pair, M, prob, run, winners, difference in cells:
+                    counts = np.bincount(winners, minlength=3)
+                    writer.write_cell(strategy_pair, M, prob, run, iterations, seed, {W: int(counts[W]) for W in [X, O, T]}, 
+                                      mode(strategy_pair))
+                    writer.write_paired(strategy_pair, strategy_pairs[0], M, prob, run, iterations, seed, difference)
+        elif grid is None:
+            evaluate_probs(range(len(p)))
+        else:
+            curve_keys = {(str(strategy_pair), M) for strategy_pair in exact_pairs + strategy_pairs for M in orders}
+            evaluated = refine_grid(evaluate_probs, p, *grid, curve_keys=curve_keys)
+            print(f"Evaluated {len(evaluated)} of {len(p)} probabilities")
+
+    if cache is not None:
+        cache.evict()
+        print(f"{cache.hits} cells from the result cache")
+
+    # aggregating and plotting only reads the stream, it can also be run on its own: python resultStream.py [stream]
+    results = aggregate(stream, spec_cells)
+    if spec["tournament"]:
+        report_tournament(stream)
+    if pruning is not None:
+        report_pruning(stream, spec_cells)
+    profiling.report()
+    if spec["plot"] is not None:
+        visualize(results, None if spec["plot"] == "show" else spec["plot"])
+    return results
+
+
+def run():
+    import argparse
+    parser = argparse.ArgumentParser(description="Simulates classical and quantum strategies in Tic-tac-toe")
+    parser.add_argument("spec", nargs="?", help="JSON or TOML file with the simulation specification")
+    parser.add_argument("--plot", help="file the plot is rendered to (headless), or 'show'")
+    parser.add_argument("--no-plot", action="store_true", help="only stream the results")
+    parser.add_argument("--workers", type=int, help="number of processes the simulations are run on")
+    parser.add_argument("--stream", help="file the results are streamed to")
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    for name in ["plot", "workers", "stream"]:
+        if getattr(args, name) is not None:
+            spec[name] = getattr(args, name)
+    if args.no_plot:
+        spec["plot"] = None
+    main(spec)
     
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run()
@@ -0,0 +1,119 @@
+import cProfile
+import pstats
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from os import environ as _environ
+from time import perf_counter
+
+# opt-in instrumentation: TTT_PROFILE=1 enables the timers and counters, TTT_PROFILE_DUMP=<file> additionally dumps
+# cProfile stats of the main process. When disabled the decorators return the functions themselves.
+ENABLED = _environ.get("TTT_PROFILE", "0") not in ("", "0") or bool(_environ.get("TTT_PROFILE_DUMP"))
+DUMP_PATH = _environ.get("TTT_PROFILE_DUMP")
+
+timers = dict()  # name -> [number of calls, cumulative seconds]
+counters = dict()  # name -> count
+__profiler = None
+
+
+def add(name, calls, seconds):
+    timer = timers.setdefault(name, [0, 0.0])
+    timer[0] += calls
+    timer[1] += seconds
+
+
+def count(name, n=1):
+    """ Adds n to the counter name """
+    if ENABLED:
+        counters[name] = counters.get(name, 0) + n
+
+
+def timed(func):
+    """ Decorator which counts the calls of func and their cumulative time (under its qualified name) """
+    if not ENABLED:
+        return func
+
+    name = func.__qualname__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            add(name, 1, perf_counter() - start)
+    return wrapper
+
+
+def phase(name):
+    """ Context manager which times a phase (a block of code) of the run """
+    if not ENABLED:
+        return nullcontext()
+    return _phase(name)
+
+
+@contextmanager
+def _phase(name):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        add(name, 1, perf_counter() - start)
+
+
+def take():
+    """ Returns and clears the timers and counters of this process, e.g. to send those of a worker to the main process """
+    if not ENABLED:
+        return None
+    taken = ({name: tuple(timer) for name, timer in timers.items()}, dict(counters))
+    timers.clear()
+    counters.clear()
+    return taken
+
+
+def merge(taken):
+    """ Adds timers and counters returned by take (of another process) to those of this process """
+    if taken is None:
+        return
+    taken_timers, taken_counters = taken
+    for name, (calls, seconds) in taken_timers.items():
+        add(name, calls, seconds)
+    for name, n in taken_counters.items():
+        count(name, n)
+
+
+def start():
+    """ Starts the cProfile profiler of this process if a dump is requested """
+    global __profiler
+    if ENABLED and DUMP_PATH and __profiler is None:
+        __profiler = cProfile.Profile()
+        __profiler.enable()
+
+
+def summary():
+    """ Returns the table of the timers, slowest first, and the counters """
+    lines = [f"{'phase':<45} {'calls':>10} {'total (s)':>10} {'per call (us)':>14}"]
+    for name, (calls, seconds) in sorted(timers.items(), key=lambda item: -item[1][1]):
+        lines.append(f"{name:<45} {calls:>10} {seconds:>10.3f} {seconds / calls * 1e6:>14.1f}")
+    for name, n in sorted(counters.items()):
+        lines.append(f"{name:<45} {n:>10}")
+
+    # the rate of counters named '<name> hits' with a matching '<name> misses'
+    for name in sorted(counters):
+        prefix = name[:-len(" hits")]
+        if name.endswith(" hits") and f"{prefix} misses" in counters:
+            lookups = counters[name] + counters[f"{prefix} misses"]
+            lines.append(f"{prefix + ' hit rate':<45} {counters[name] / lookups if lookups else 0:>10.1%}")
+    return "\n".join(lines)
+
+
+def report():
+    """ Prints the summary table and dumps the cProfile stats, if profiling is enabled """
+    global __profiler
+    if not ENABLED:
+        return
+    if __profiler is not None:
+        __profiler.disable()
+        pstats.Stats(__profiler).dump_stats(DUMP_PATH)
+        __profiler = None
+        print(f"cProfile stats written to {DUMP_PATH}")
+    print(summary())
@@ -0,0 +1,142 @@
+import hashlib
+import inspect
+import json
+import os
+import re
+from functools import lru_cache
+import StateTable
+import strategy
+
+RESULT_VERSION = 1  # increase whenever the engine changes the results of unchanged strategies outside strategy.py
+RESULT_CACHE_DIR = os.path.join(StateTable.CACHE_DIR, "results")
+MAX_BYTES = int(float(os.environ.get("TTT_RESULT_CACHE_MB", "64")) * 2**20)
+
+# the modules which play the games, a change in any of them invalidates all cached results
+ENGINE_MODULES = ["ClassicalBoard", "QuantumBoard", "StateTable", "batchEngine", "game", "sweep", "constants", "helperFunctions"]
+
+
+def source_hash(text):
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def strategy_classes():
+    """ The strategy classes of strategy.py, subclasses of Strategy defined there """
+    return [cls for cls in vars(strategy).values()
+            if isinstance(cls, type) and issubclass(cls, strategy.Strategy) and cls.__module__ == strategy.__name__]
+
+
+@lru_cache(maxsize=None)
+def engine_fingerprint():
+    """
+    The hash of the sources of the engine: the ENGINE_MODULES and strategy.py without its strategy classes (e.g. the
+    compiled policies), such that a change of one strategy class only invalidates the results of that strategy
+    """
+    strategy_source = inspect.getsource(strategy)
+    for cls in strategy_classes():
+        strategy_source = strategy_source.replace(inspect.getsource(cls), "")
+    sources = [inspect.getsource(__import__(name)) for name in ENGINE_MODULES] + [strategy_source]
+    return source_hash("\n".join(sources))
+
+
+def used_classes(cls):
+    """ The strategy classes a strategy class depends on: its base classes and the classes they compose, transitively """
+    used, pending = [], [cls]
+    while pending:
+        current = pending.pop()
+        if current in used:
+            continue
+        used.append(current)
+        source = inspect.getsource(current)
+        pending += [base for base in current.__mro__ if base in strategy_classes()]
+        pending += [other for other in strategy_classes() if re.search(rf"\b{other.__name__}\b", source)]
+    return sorted(used, key=lambda used_cls: used_cls.__name__)
+
+
+@lru_cache(maxsize=None)
+def class_fingerprint(cls):
+    """ The hash of the sources of a strategy class and of the strategy classes it uses (see used_classes) """
+    return source_hash("\n".join(inspect.getsource(used_cls) for used_cls in used_classes(cls)))
+
+
+def strategy_fingerprint(strategy):
+    """ The class and the parameters (scalar attributes, apart from the mistake probability of the cell) of a strategy """
+    parameters = {name: value for name, value in vars(strategy).items()
+                  if isinstance(value, (bool, int, float, str)) and name != "mistake_prob"}
+    return {"class": type(strategy).__name__, "source": class_fingerprint(type(strategy)), "parameters": parameters}
+
+
+class ResultCache:
+    """
+    Content addressed cache of the results of cells on disk, shared by all sweeps. A cell is stored under the hash of
+    everything its result depends on: the strategies of the pair (their sources and parameters), the cell (order M,
+    probability, iterations, seed, ...), the state table and the engine. Changing or adding a strategy therefore only
+    computes the cells of that strategy again. The simulated cells are seeded by the index of their pair in the spec
+    (see sweep.cell_rng), which is part of their key: appending pairs to a spec is incremental, but inserting or
+    reordering pairs changes the seeds, and so the results, of the pairs behind them. Files are evicted least recently
+    used first when the cache exceeds max_bytes.
+    """
+    def __init__(self, path=RESULT_CACHE_DIR, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, strategy_pair, **cell):
+        """ The key of the cell with the keyword fields cell (e.g. M, prob, iterations, seed) of strategy_pair """
+        content = {"version": RESULT_VERSION, "table": StateTable.rules(), "engine": engine_fingerprint(),
+                   "pair": [strategy_fingerprint(strategy) for strategy in strategy_pair], "cell": cell}
+        return source_hash(json.dumps(content, sort_keys=True, default=str))
+
+    def file(self, key):
+        return os.path.join(self.path, f"{key}.json")
+
+    def get(self, key):
+        """ Returns the record stored under key, or None """
+        try:
+            with open(self.file(key)) as f:
+                record = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        os.utime(self.file(key))  # the last use, for the eviction
+        self.hits += 1
+        return record
+
+    def __setitem__(self, key, record):
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            # written to a temporary file first such that an interrupted write does not leave a broken result
+            with open(self.file(key) + ".tmp", "w") as f:
+                json.dump(record, f)
+            os.replace(self.file(key) + ".tmp", self.file(key))
+        except OSError:
+            pass  # the cache is an optimization only
+
+    def evict(self):
+        """ Removes the least recently used results until the cache is at most max_bytes """
+        try:
+            entries = [entry for entry in os.scandir(self.path) if entry.name.endswith(".json")]
+        except OSError:
+            return
+        files = []  # (last use, size, path)
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue  # removed by a concurrent sweep
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in files:
+            if size <= self.max_bytes:
+                break
+            size -= file_size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __repr__(self):
+        return f"ResultCache({self.path!r}, {self.hits} hits, {self.misses} misses)"
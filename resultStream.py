@@ -0,0 +1,200 @@
+import json
+import sys
+from math import sqrt
+from constants import *
+from game import binomial_results
+from profiling import timed
+
+
+# the modes in which the cells are played, see sweep_mode
+EXACT = "exact"
+INDEPENDENT = "independent"
+TOURNAMENT = "tournament"  # all pairs with common random numbers, see sweep.tournament_cells
+COUPLED = "coupled"  # every game played once for all probabilities, see sweep.coupled_cells
+
+
+def sweep_mode(sampling=None, pruning=None):
+    """ The mode of the simulated cells of a sweep: independent runs of [iterations] games, or adaptively sampled with
+    sampling (target_se, batch_size, max_games), see sweep.run_cell, either with superpositions pruned by pruning
+    (threshold, top_k). Cells of different modes are different cells """
+    mode = INDEPENDENT if sampling is None else f"adaptive {list(sampling)}"
+    return mode if pruning is None else f"{mode} pruned {list(pruning)}"
+
+
+def record_mode(record):
+    """ The mode of the cell of a record, derived from the record if it was written before modes were recorded """
+    if "mode" in record:
+        return record["mode"]
+    return EXACT if "outcome" in record else "adaptive" if record.get("adaptive") else INDEPENDENT
+
+
+class ResultWriter:
+    """
+    Appends the results of sweep cells to a JSON lines file, one line per cell which is flushed as soon as the cell is
+    done, such that the results survive a crash or interrupt of a sweep.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.__file = open(path, "a+")
+        if self.__file.tell() > 0:
+            self.__file.seek(self.__file.tell() - 1)
+            if self.__file.read(1) != "\n":
+                self.__file.write("\n")  # ends a line which was cut off by a crash, such that it is skipped
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, record):
+        """ Appends the record to the stream and returns it """
+        self.__file.write(json.dumps(record) + "\n")
+        self.__file.flush()
+        return record
+
+    def write_cell(self, strategy_pair, M, prob, run, iterations, seed, wins, mode=INDEPENDENT, pruned=None):
+        """ Writes the wins {X, O, T} of the simulated games of a cell played in mode (see sweep_mode), of an 
+        adaptively sampled cell (see sweep.run_cell) the number of games is the sum of the wins instead of iterations.
+        pruned is the discarded probability of a cell with pruned superpositions (see sweep.run_cell) """
+        record = {"pair": str(strategy_pair), "M": M, "prob": prob, "run": run, "iterations": iterations, "seed": seed,
+                  "mode": mode, "wins": {str(W): wins[W] for W in [X, O, T]}, "games": sum(wins.values())}
+        if pruned is not None:
+            record["pruning"] = pruned
+        return self.write(record)
+
+    def write_exact(self, strategy_pair, M, prob, iterations, outcome):
+        """ Writes the exact outcome probabilities {X, O, T} of a cell """
+        return self.write({"pair": str(strategy_pair), "M": M, "prob": prob, "run": None, "iterations": iterations,
+                           "seed": None, "mode": EXACT, "outcome": {str(W): outcome[W] for W in [X, O, T]}})
+
+    def write_paired(self, strategy_pair, reference_pair, M, prob, run, iterations, seed, difference):
+        """ Writes the paired difference (mean, variance, variance if independent) of the tie rates of strategy_pair
+        and reference_pair in a tournament cell, see sweep.paired_differences """
+        mean, variance, independent_variance = difference
+        self.write({"pair": str(strategy_pair), "reference": str(reference_pair), "M": M, "prob": prob, "run": run,
+                    "iterations": iterations, "seed": seed, "paired": {"mean": mean, "variance": variance, 
+                                                                        "independent_variance": independent_variance}})
+
+    def close(self):
+        self.__file.close()
+
+
+def read_records(path):
+    """ Yields the records of a result stream, a line which was cut off by a crash is skipped """
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        return
+
+
+def cell_key(record):
+    return record["pair"], record["M"], record["prob"], record["run"], record["iterations"], record["seed"], record_mode(record)
+
+
+def completed_cells(path):
+    """ Returns the keys (pair, M, prob, run, iterations, seed, mode) of the cells in the result stream """
+    return {cell_key(record) for record in read_records(path) if "paired" not in record}
+
+
+def cell_spec(record):
+    """ The part of the spec which determines the result of a cell: iterations, seed and how the cell is played """
+    return record["iterations"], record["seed"], record_mode(record)
+
+
+@timed
+def aggregate(path, cells=None):
+    """
+    Reads a result stream and returns the mean and std {X, O, T} of the wins in [iterations] games per (pair, M, prob),
+    the structure visualize consumes. The pairs are the names of the strategy pairs in the stream. Only the cells whose
+    keys (see cell_key) are in cells are aggregated, e.g. those of the spec of a sweep, and a cell which is in the
+    stream more than once counts once. With cells None all cells are aggregated, which raises an Exception if the
+    stream holds cells of several specs (see cell_spec) of the same (pair, M, prob).
+    """
+    records = dict()  # cell key -> record
+    for record in read_records(path):
+        if "paired" not in record and (cells is None or cell_key(record) in cells):
+            records[cell_key(record)] = record
+
+    specs = dict()  # (pair, M, prob) -> spec of its cells
+    for record in records.values():
+        key, spec = (record["pair"], record["M"], record["prob"]), cell_spec(record)
+        if specs.setdefault(key, spec) != spec:
+            raise Exception(f"Result stream {path} holds cells of {key} of several specs {specs[key]} and {spec}, "
+                            f"aggregate the cells of one spec")
+
+    combined_results = dict()
+    sums = dict()  # (pair, M, prob) -> [number of runs, {W: sum of wins}, {W: sum of squared wins}]
+    for record in records.values():
+        key = (record["pair"], record["M"], record["prob"])
+        if "outcome" in record:
+            combined_results[key] = binomial_results({int(W): P for W, P in record["outcome"].items()}, record["iterations"])
+            continue
+        if record_mode(record).startswith("adaptive"):
+            # an adaptive cell is a single run of any number of games, its outcome rates are scaled to [iterations]
+            # games with the binomial std of a run of [iterations] games
+            outcome = {int(W): wins / record["games"] for W, wins in record["wins"].items()}
+            combined_results[key] = binomial_results(outcome, record["iterations"])
+            continue
+
+        n, total, squares = sums.setdefault(key, [0, {W: 0 for W in [X, O, T]}, {W: 0 for W in [X, O, T]}])
+        sums[key][0] += 1
+        for W, wins in record["wins"].items():
+            total[int(W)] += wins
+            squares[int(W)] += wins**2
+
+    for key, (n, total, squares) in sums.items():
+        combined_results[key] = {W: (total[W] / n, sqrt(max(squares[W] / n - (total[W] / n)**2, 0))) for W in [X, O, T]}
+
+    return combined_results
+
+
+def paired_summary(path):
+    """
+    Reads the paired differences of a tournament from a result stream and returns per (pair, reference, M, prob) the
+    mean difference of the tie rates over the runs, its standard error and the standard error it would have if the
+    games of the pairs were independent
+    """
+    sums = dict()  # key -> [number of games, sum of differences, sum of variances, sum of independent variances]
+    for record in read_records(path):
+        if "paired" not in record:
+            continue
+        key = (record["pair"], record["reference"], record["M"], record["prob"])
+        total = sums.setdefault(key, [0, 0.0, 0.0, 0.0])
+        total[0] += record["iterations"]
+        total[1] += record["paired"]["mean"] * record["iterations"]
+        total[2] += record["paired"]["variance"] * record["iterations"]
+        total[3] += record["paired"]["independent_variance"] * record["iterations"]
+
+    return {key: (total / n, sqrt(variance / n / n), sqrt(independent_variance / n / n)) 
+            for key, (n, total, variance, independent_variance) in sums.items()}
+
+
+def pruning_summary(path, cells=None):
+    """
+    Reads the discarded probability of the cells with pruned superpositions from a result stream and returns per
+    (pair, M, prob) the number of pruned games and the mean discarded probability per ply of a game. Only the cells
+    whose keys are in cells are summarized (None summarizes all), a cell which is in the stream more than once counts once.
+    """
+    records = {cell_key(record): record for record in read_records(path)
+               if "pruning" in record and (cells is None or cell_key(record) in cells)}
+
+    sums = dict()  # (pair, M, prob) -> [number of pruned games, discarded probability per ply]
+    for record in records.values():
+        total = sums.setdefault((record["pair"], record["M"], record["prob"]), [0, [0.0] * len(record["pruning"]["discarded"])])
+        total[0] += record["pruning"]["games"]
+        total[1] = [a + b for a, b in zip(total[1], record["pruning"]["discarded"])]
+
+    return {key: (games, [discarded / max(games, 1) for discarded in per_ply]) for key, (games, per_ply) in sums.items()}
+
+
+if __name__ == "__main__":
+    # aggregating and plotting a result stream, separate from running the sweep
+    # python resultStream.py [stream] [plot file], without a plot file the plot is shown in a window
+    from main import visualize
+    visualize(aggregate(sys.argv[1] if len(sys.argv) > 1 else "results.jsonl"), sys.argv[2] if len(sys.argv) > 2 else None)
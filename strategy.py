@@ -1,33 +1,249 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from ClassicalBoard import Board
-from QuantumBoard import QuBoard
+from QuantumBoard import QuBoard, DenseQuBoard, TransitionMatrix
+from StateTable import get_table
+import numpy as np
 from constants import *
 from helperFunctions import *
-from random import random, choice
+from profiling import timed
+
+class PolicyMemo:
+    """
+    Memo of the moves chosen by the strategies during a game, keyed by board, such that a board which is encountered
+    again is followed by the same move. The memo is reset before every game, its hit and miss counters are not.
+    """
+    def __init__(self):
+        self.moves = dict()  # Board -> Board
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"<PolicyMemo hits={self.hits} misses={self.misses}>"
+
+    def __len__(self):
+        return len(self.moves)
+
+    def __setitem__(self, board, move):
+        self.moves[board] = move
+
+    def get(self, board):
+        """ Returns the memoized move of board, or None if no move was chosen yet """
+        move = self.moves.get(board)
+        if move is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return move
+
+    def reset(self):
+        self.moves.clear()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+
+class SuperpositionCache:
+    """
+    LRU cache of the superpositions of the games of a cell, keyed by the decisions the classical strategy made so far.
+    The quantum strategies are deterministic, so equal decisions lead to equal superpositions (see 
+    game.play_cached_game). The probability arrays of the kept superpositions take at most max_bytes, the least
+    recently used superposition is evicted first.
+    """
+    def __init__(self, max_bytes=32 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.superpositions = OrderedDict()  # decisions -> (superposition, the move at which it continues)
+        self.nbytes = 0  # of the probability arrays of the superpositions
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"<SuperpositionCache size={len(self)} bytes={self.nbytes} hits={self.hits} misses={self.misses}>"
+
+    def __len__(self):
+        return len(self.superpositions)
+
+    @staticmethod
+    def size(value):
+        """ The bytes taken by a cached (superposition, move), those of its (dense) probability array """
+        return value[0].get_probs().nbytes
+
+    def __setitem__(self, decisions, value):
+        if decisions in self.superpositions:
+            self.nbytes -= SuperpositionCache.size(self.superpositions[decisions])
+        self.superpositions[decisions] = value
+        self.superpositions.move_to_end(decisions)
+        self.nbytes += SuperpositionCache.size(value)
+        while self.nbytes > self.max_bytes and self.superpositions:
+            self.nbytes -= SuperpositionCache.size(self.superpositions.popitem(last=False)[1])
+
+    def get(self, decisions):
+        """ Returns the cached (superposition, move) after decisions, or None if they were not made before """
+        value = self.superpositions.get(decisions)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.superpositions.move_to_end(decisions)
+        return value
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+
+class CommonRandomNumbers:
+    """
+    The random numbers of one game, used in place of a numpy Generator by the classical strategies (dense path) and
+    the measurement. Every board id has its own random numbers, for the choice of a good move, for whether a mistake is
+    made and for the choice of the mistake. Games of different strategy pairs and orders which are given the
+    CommonRandomNumbers of the same seed make the same decisions on the same boards, such that the differences of
+    their outcomes are due to the strategies rather than to chance.
+    """
+    def __init__(self, seed):
+        rng = np.random.default_rng(seed)
+        self.key = rng.integers(2**64, dtype=np.uint64)  # of the counter-based numbers of the boards, see fields
+        self.measurement = rng.random()  # the number of the measurement of the final superposition (see measure)
+        self.rng = rng  # for any other draws, which are not common
+
+    def fields(self, states, field=slice(None)):
+        """ The numbers (good, mistake, choice of mistake) x board id of the array states, or those of field only """
+        # the numbers are derived on demand from the key and the counter (board id, field) by the SplitMix64 finalizer,
+        # so a game costs the boards it visits rather than the size of the table
+        counters = np.asarray(states, dtype=np.uint64) * np.uint64(3) + np.arange(3, dtype=np.uint64)[field, None]
+        z = self.key + (counters + np.uint64(1)) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z ^= z >> np.uint64(31)
+        return (z >> np.uint64(11)) * 2.0 ** -53  # the upper 53 bits, uniform in [0, 1)
+
+    def random(self, size=None):
+        return self.rng.random(size)
+
+    def integers(self, *args, **kwargs):
+        return self.rng.integers(*args, **kwargs)
+
+
+class CompiledPolicy:
+    """
+    Immutable transition table of a strategy over the board ids. Row i holds the successor ids of board i with the
+    weight of every successor for a good move and for a mistake. On the boards with possible mistakes a mistake is made
+    with probability p, which is the only parameter of the table. Compiled once per state table (see compile_policy)
+    and shared read-only by all strategies, games and (forked) workers.
+    """
+    def __init__(self, table, mistakes):
+        self.table = table
+        self.mistakes = mistakes
+        self.good = TransitionMatrix.uniform(table.arrays["good_ptr"], table.arrays["good_ids"])
+        self.has_mistakes = np.diff(table.arrays["mistake_ptr"]) > 0  # id -> whether a mistake can be made
+
+        # the good moves and the mistakes merged into one layout of entries, with separate weights for both kinds of
+        # moves: the good layout weighs the good moves (its mistakes weigh 0), the mistake layout the mistakes
+        mistake = TransitionMatrix.uniform(table.arrays["mistake_ptr"], table.arrays["mistake_ids"])
+        zeros = np.zeros(len(self.has_mistakes))
+        good_layout = TransitionMatrix.sum([self.good, mistake.scale(zeros)])
+        mistake_layout = TransitionMatrix.sum([self.good.scale(zeros), mistake])
+        self.layout = good_layout  # the entries (ptr, ids, rows) shared by both layouts
+        self.good_weights, self.mistake_weights = good_layout.weights, mistake_layout.weights
+
+        for array in [self.good.ids, self.good.weights, self.good.rows, self.has_mistakes, self.layout.ids,
+                      self.layout.rows, self.good_weights, self.mistake_weights]:
+            array.flags.writeable = False
+
+    def transition(self, p=0):
+        """ Returns the transition matrix of a move with mistake probability p, averaged over the random choices """
+        if not self.mistakes or p == 0:
+            return self.good
+        mistake_probs = np.where(self.has_mistakes, p, 0)[self.layout.rows]
+        return TransitionMatrix(self.layout.ptr, self.layout.ids, 
+                                self.good_weights * (1 - mistake_probs) + self.mistake_weights * mistake_probs)
+
+    def pick(self, states, rng, p=0):
+        """ Chooses the next board id for every board id in the array states, with mistake probability p. rng is a
+        numpy Generator or CommonRandomNumbers """
+        if isinstance(rng, CommonRandomNumbers):
+            # the random numbers of the boards themselves, the same in every game which uses them
+            good_uniforms, mistake_uniforms, choice_uniforms = rng.fields(states)
+        else:
+            good_uniforms, mistake_uniforms, choice_uniforms = rng.random(len(states)), None, None
+
+        next_states = self.table.choose("good", states, good_uniforms)
+        if not self.mistakes:
+            return next_states
+
+        # boards with possible mistakes on which we make a mistake
+        if mistake_uniforms is None:
+            mistake_uniforms = rng.random(len(states))
+        mistakes = self.has_mistakes[states] & (mistake_uniforms < p)
+        if choice_uniforms is None:
+            choice_uniforms = np.empty(len(states))
+            choice_uniforms[mistakes] = rng.random(np.count_nonzero(mistakes))
+        next_states[mistakes] = self.table.choose("mistake", states[mistakes], choice_uniforms[mistakes])
+        return next_states
+
+    def mistake_uniforms(self, states, crn):
+        """ Returns the numbers of the CommonRandomNumbers crn which decide whether a mistake is made on the boards of
+        the array states which allow one, a mistake is made iff its number is below p (see pick) """
+        if not self.mistakes:
+            return np.empty(0)
+        return crn.fields(states[self.has_mistakes[states]], 1)
+
+
+__policies = dict()  # (id of the state table, mistakes) -> CompiledPolicy
+
+def compile_policy(table, mistakes=False):
+    """ Returns the compiled policy of the strategies which make good moves, and mistakes if mistakes is True """
+    key = (id(table), mistakes)
+    if key not in __policies or __policies[key].table is not table:
+        __policies[key] = CompiledPolicy(table, mistakes)
+    return __policies[key]
+
 
 class Strategy(ABC):
+    linear = False  # whether a move is a fixed (expected) transition matrix, independent of the superposition
+
     def __init__(self, B_X, B_O, B_T, E):
         self.B_X = B_X
         self.B_O = B_O
         self.B_T = B_T
         self.E = E
+        self.table = get_table()  # successors and win-states looked up by board id
+        self.rng = np.random.default_rng()  # source of all random choices of the strategy
+        self.policy = self.compile()  # the moves of the strategy as a (shared) transition table
 
     def __repr__(self):
         return f"<{self.__class__.__name__}>"
 
+    def set_rng(self, rng):
+        """ Sets the numpy Generator from which the strategy draws its random choices """
+        self.rng = rng
+
     
+    def compile(self):
+        """ Returns the compiled transition table of the moves of the strategy, see CompiledPolicy """
+        return compile_policy(self.table)
+
     @abstractmethod
     def next_move(self, board, prior_mappings, move):
         pass
 
+    def expected_transition(self):
+        """ Returns the transition matrix of a move averaged over the random choices of the strategy """
+        raise Exception(f"{self} has no transition matrix since its moves are not linear")
+
 class ClassicalStrategy(Strategy):
-    def __init__(self, *args):
-        return super().__init__(*args)
+    linear = True
+    mistake_prob = 0
 
+    @timed
     def next_move(self, quboard, prior_mappings, move):
-        if move == 9:
+        if move == SIZE:
             return quboard, prior_mappings
 
+        if isinstance(quboard, DenseQuBoard):
+            return self.dense_next_move(quboard)[0], prior_mappings
+
         decomposition = {}
         for board in quboard.get_decomp().keys():
             # classically determine next move
@@ -40,38 +256,50 @@ class ClassicalStrategy(Strategy):
             else:
                 decomposition[next_board] = quboard.get_decomp()[board]
         
-        return QuBoard(decomposition), prior_mappings
+        return QuBoard.trusted(decomposition), prior_mappings
     
+    def dense_next_move(self, quboard):
+        """ Classically determines the next move of all boards of a DenseQuBoard at once, returns the next superposition
+        and the chosen next board ids (ordered by the board ids of quboard) """
+        probs = quboard.get_probs()
+        states = np.flatnonzero(probs)
+        next_states = self.classical_next_states(states, self.rng)
+        return DenseQuBoard.trusted(np.bincount(next_states, weights=probs[states], minlength=len(probs))), next_states
+
     @abstractmethod
     def classical_next_move(self, board: Board, prior_mappings):
         pass
 
+    @timed
+    def classical_next_states(self, states, rng):
+        """ Vectorized classical_next_move: chooses the next board id for every board id in the array states """
+        return self.policy.pick(states, rng, self.mistake_prob)
+
+    def expected_transition(self):
+        return self.policy.transition(self.mistake_prob)
+
 
 class ClassicalWithoutMistakes(ClassicalStrategy):
     def classical_next_move(self, board, prior_mappings):
         """ This function chooses a board following the most optimal classical strategy """ 
-        if board in prior_mappings.keys():
-            return prior_mappings[board]
-
-        type = T
-        if board.get_board() in self.B_X:
-            type = X
-        elif board.get_board() in self.B_O:
-            type = O 
-
-        possible_next_moves = list(filter(lambda x: (type == T and x in self.B_T) 
-                                          or (type == X and x in self.B_X) 
-                                          or (type == O and x in self.B_O), board.get_next_boards()))
+        next_move = prior_mappings.get(board)
+        if next_move is None:
+            next_move = self.good_move(board)
+            prior_mappings[board] = next_move
+
+        return next_move, prior_mappings
+
+    def good_move(self, board: Board):
+        """ Chooses one of the good moves of board at random """
+        # the good moves are the next boards with the same win-state as the board
+        possible_next_moves = self.table.good_boards(board.get_board())
         
         if not possible_next_moves:
             print(board.get_board(), board.get_board() in self.B_T, board.get_board() in self.B_O, 
-                  board.get_board() in self.B_T, type, board.get_next_boards())
+                  board.get_board() in self.B_T, board.get_next_boards())
             raise Exception ("no next moves")
 
-        next_move = choice(possible_next_moves)
-        prior_mappings[board] = Board(next_move)
-
-        return Board(next_move), prior_mappings
+        return Board(possible_next_moves[self.rng.integers(len(possible_next_moves))])
     
 class ClassicalWithMistakes(ClassicalStrategy):
     def __init__(self, *args):
@@ -79,18 +307,28 @@ class ClassicalWithMistakes(ClassicalStrategy):
         self.no_mistakes_strategy = ClassicalWithoutMistakes(*args)
         super().__init__(*args)
 
+    def compile(self):
+        return compile_policy(self.table, mistakes=True)
+
     def classical_next_move(self, board: Board, prior_mappings):
-        if board in prior_mappings.keys():  # ensure prior mistakes are repeated 
-            return prior_mappings[board]
+        next_move = prior_mappings.get(board)  # ensure prior mistakes are repeated 
+        if next_move is not None:
+            return next_move, prior_mappings
         
-        if board.get_board() in self.E.keys() and random() < self.mistake_prob:  # we may make a mistake now
-            new_move = choice(list(self.E[board.get_board()]))
-            prior_mappings[board] = Board(new_move)
-            return Board(new_move), prior_mappings
+        mistakes = self.table.mistake_boards(board.get_board())
+        if mistakes and self.rng.random() < self.mistake_prob:  # we may make a mistake now
+            next_move = Board(mistakes[self.rng.integers(len(mistakes))])
+        else:
+            # we will make no mistake
+            next_move = self.no_mistakes_strategy.good_move(board)
         
-        # we will make no mistake
-        return self.no_mistakes_strategy.classical_next_move(board, prior_mappings)
-    
+        prior_mappings[board] = next_move
+        return next_move, prior_mappings
+
+    def set_rng(self, rng):
+        super().set_rng(rng)
+        self.no_mistakes_strategy.set_rng(rng)
+
     def set_mistake_prob(self, p):
         if not 0 <= p <= 1:
             raise Exception (f"Invalid Probability {p}")
@@ -98,18 +336,25 @@ class ClassicalWithMistakes(ClassicalStrategy):
         self.mistake_prob = p
 
 class QuantumEqualSuperposition(Strategy):
+    linear = True
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        # the move to all good moves with equal probability, as a sparse matrix over the board ids
+        self.transition = self.policy.transition()
+
+    @timed
     def next_move(self, quboard, prior_mappings, move):
-        if move == 9:
+        if move == SIZE:
             return quboard, prior_mappings
+
+        if isinstance(quboard, DenseQuBoard):
+            return DenseQuBoard.trusted(self.transition.apply(quboard.get_probs())), prior_mappings
         
         decomposition = {}
         for board in quboard.get_decomp().keys():
-            # generate all possible moves 
-            next_boards = Board(board).get_next_boards()
-
-            # filter the moves to only good moves
-            win_class = self.B_X if board in self.B_X else (self.B_O if board in self.B_O else self.B_T)  # determine the win-state set in which the board resides
-            next_boards = set(filter(lambda x: x in win_class, next_boards)) 
+            # all possible moves which keep the win-state in which the board resides
+            next_boards = self.table.good_boards(board)
 
             # create a new decomposition of all possible good moves
             for next_board in next_boards:
@@ -118,20 +363,31 @@ class QuantumEqualSuperposition(Strategy):
                 else:
                     decomposition[next_board] = quboard.get_decomp()[board] * 1/len(next_boards)
 
-        return QuBoard(decomposition), prior_mappings
+        return QuBoard.trusted(decomposition), prior_mappings
+
+    def expected_transition(self):
+        if not self.linear:
+            return super().expected_transition()
+        return self.transition
     
 class QuantumEndAmplification(QuantumEqualSuperposition):
+    linear = False  # amplification depends on the superposition
+
+    @timed
     def next_move(self, board, prior_mappings, move):
         player = X if move % 2 == 0 else O
 
         board, prior_mappings = super().next_move(board, prior_mappings, move)
 
-        if move == 8 or move == 9:
+        if move == SIZE - 1 or move == SIZE:
             board.amplify(self.B_X if player == X else self.B_O)
 
         return board, prior_mappings
     
 class QuantumFullAmplification(QuantumEqualSuperposition):
+    linear = False  # amplification depends on the superposition
+
+    @timed
     def next_move(self, board, prior_mappings, move):
         player = X if move % 2 == 0 else O
 
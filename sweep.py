@@ -0,0 +1,300 @@
+from functools import partial
+from itertools import product
+from math import sqrt
+import numpy as np
+from constants import *
+from strategy import ClassicalWithMistakes, SuperpositionCache, CommonRandomNumbers
+from QuantumBoard import QuBoard, Pruning
+from game import play_game, play_cached_game, play_coupled_game, evaluate
+from resultStream import sweep_mode, TOURNAMENT, COUPLED
+import batchEngine
+import profiling
+
+__strategy_pairs = None  # the strategy pairs of this worker
+__pruning = None  # (threshold, top_k) of the approximate superpositions of this worker, None plays exact games
+
+# the spawn keys of the common random numbers of coupled cells start with this tag, such that they never collide with
+# those of other kinds of cells (e.g. cell_rng, whose keys also consist of 4 indices)
+COUPLED_TAG = int.from_bytes(COUPLED.encode(), "big")
+
+
+def init_worker(board_sets, pair_classes, pruning=None):
+    """ Builds the strategy pairs of a worker once from the categorized board sets (B_T, B_X, B_O, E) """
+    global __strategy_pairs, __pruning
+    B_T, B_X, B_O, E = board_sets
+    __strategy_pairs = [tuple(cls(B_X, B_O, B_T, E) for cls in classes) for classes in pair_classes]
+    __pruning = pruning
+
+
+def cell_rng(seed, pair_index, M, prob_index, run):
+    """ Returns the random generator of a cell, independent of the generators of all other cells """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(pair_index, M, prob_index, run)))
+
+
+def game_crn(seed, *key):
+    """ Returns the CommonRandomNumbers of the game with spawn key key, independent of those of all other games """
+    return CommonRandomNumbers(np.random.SeedSequence(seed, spawn_key=key))
+
+
+def run_profiled(run, cell):
+    """ run(cell) and the timers of the worker since its last cell (None if profiling is disabled) """
+    return run(cell), profiling.take()
+
+
+def run_pool(run, cells, strategy_pairs, board_sets, workers, desc, pruning=None):
+    """ Yields run(cell) for every cell in order, run on a pool of [workers] processes (None uses all cores) """
+    if not cells:
+        return
+
+    # only imported when a sweep is run, which keeps the import of the simulations light
+    from concurrent.futures import ProcessPoolExecutor
+    from tqdm import tqdm
+
+    # the workers build their own strategies of the same classes, only the board sets are send (once per worker)
+    pair_classes = [tuple(type(strategy) for strategy in strategy_pair) for strategy_pair in strategy_pairs]
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(board_sets, pair_classes, pruning)) as executor:
+        for result, timers in tqdm(executor.map(partial(run_profiled, run), cells), total=len(cells), desc=desc):
+            profiling.merge(timers)
+            yield result
+
+
+def cell_mode(strategy_pair, sampling=None, pruning=None):
+    """ The mode of the cells of strategy_pair in a sweep, see resultStream.sweep_mode """
+    # the classical games of the batch engine have no superpositions, pruning does not change them
+    return sweep_mode(sampling, None if batchEngine.supports(strategy_pair) else pruning)
+
+
+def play_games(strategy_pair, M, n_games, rng, cache=None, pruning=None):
+    """ Plays n_games games and returns the number of wins {X, O, T}, with superpositions cached or pruned """
+    # the superpositions of games with quantum strategies are reused through the SuperpositionCache cache of the cell
+    # (a new one if None), or with a Pruning pruning they are approximated on the sparse QuBoard backend
+    if batchEngine.supports(strategy_pair):
+        # classical games are played all at once
+        return batchEngine.play_classical_batch(strategy_pair, M, n_games, rng)
+
+    if pruning is not None:
+        # the superpositions of the games are pruned after every move
+        wins = {X: 0, O: 0, T: 0}
+        for _ in range(n_games):
+            wins[evaluate(play_game(strategy_pair, M, backend=QuBoard, pruning=pruning), rng)] += 1
+        return wins
+
+    if cache is None:
+        cache = SuperpositionCache()
+    wins = {X: 0, O: 0, T: 0}
+    for _ in range(n_games):
+        wins[evaluate(play_cached_game(strategy_pair, M, cache), rng)] += 1
+    return wins
+
+
+def tie_rate_se(wins):
+    """ The standard error of the tie rate of the games in wins, with one tie and one other outcome added """
+    # the added outcomes keep a cell with only (or no) ties so far from a standard error of 0
+    n = sum(wins.values())
+    if n == 0:
+        return float("inf")
+    rate = (wins[T] + 1) / (n + 2)
+    return sqrt(rate * (1 - rate) / n)
+
+
+@profiling.timed
+def run_cell(cell):
+    """ Plays the games of a cell, returns the cell, its wins {X, O, T} and its discarded probability (None if exact) """
+    # without sampling the cell is [iterations] games, with sampling (target_se, batch_size, max_games) batches of games
+    # are played until the standard error of the tie rate is at most target_se or max_games games are played. A pruned
+    # cell returns {"discarded": probability discarded per ply summed over the games, "games": pruned games}
+    pair_index, M, prob_index, prob, run, iterations, seed, sampling = cell
+    strategy_pair = __strategy_pairs[pair_index]
+
+    # updating strategy variables, the strategies of a worker are only used by one cell at a time
+    rng = cell_rng(seed, pair_index, M, prob_index, run)
+    for strategy in strategy_pair:
+        strategy.set_rng(rng)
+        if isinstance(strategy, ClassicalWithMistakes):
+            strategy.set_mistake_prob(prob)
+
+    # the quantum superpositions following the same classical decisions are reused across the games of the cell
+    cache = SuperpositionCache()
+    pruning = Pruning(*__pruning) if __pruning is not None and not batchEngine.supports(strategy_pair) else None
+    if sampling is None:
+        wins = play_games(strategy_pair, M, iterations, rng, cache, pruning)
+    else:
+        target_se, batch_size, max_games = sampling
+        wins = {X: 0, O: 0, T: 0}
+        while True:
+            n_games = min(batch_size, max_games - sum(wins.values()))
+            for W, count in play_games(strategy_pair, M, n_games, rng, cache, pruning).items():
+                wins[W] += count
+            if sum(wins.values()) >= max_games or tie_rate_se(wins) <= target_se:
+                break
+
+    profiling.count("SuperpositionCache hits", cache.hits)
+    profiling.count("SuperpositionCache misses", cache.misses)
+    pruned = {"discarded": pruning.discarded.tolist(), "games": pruning.games} if pruning is not None else None
+    return cell, wins, pruned
+
+
+def sweep_cells(strategy_pairs, board_sets, orders, p, iterations, num_runs, seed=0, workers=None, skip=(), sampling=None,
+                prob_indices=None, pruning=None):
+    """ Plays the cells of a sweep which are not in skip, yields (strategy_pair, M, prob, run, wins, pruned) per cell """
+    # every cell draws from its own generator seeded by seed and the cell, so the results do not depend on the number
+    # of workers or on which cells were skipped. The keys in skip are those of resultStream.cell_key, the mode of which
+    # includes sampling and pruning (see cell_mode). With sampling every cell is one adaptively sized run (see run_cell), pruning
+    # (threshold, top_k) approximates the superpositions (see QuBoard.prune). Only the probabilities p[i] for i in
+    # prob_indices are played (None plays all), a probability is seeded by its index in p.
+    if sampling is not None:
+        num_runs = 1
+    if prob_indices is None:
+        prob_indices = range(len(p))
+
+    modes = [cell_mode(strategy_pair, sampling, pruning) for strategy_pair in strategy_pairs]
+    cells = [(pair_index, M, prob_index, p[prob_index], run, iterations, seed, sampling)
+             for run, pair_index, M, prob_index in product(range(num_runs), range(len(strategy_pairs)), orders, prob_indices)
+             if (str(strategy_pairs[pair_index]), M, p[prob_index], run, iterations, seed, modes[pair_index]) not in skip]
+    for cell, wins, pruned in run_pool(run_cell, cells, strategy_pairs, board_sets, workers, "Running simulations...",
+                                       pruning):
+        pair_index, M, _, prob, run, _, _, _ = cell
+        yield strategy_pairs[pair_index], M, prob, run, wins, pruned
+
+
+def run_coupled_cell(cell):
+    """ Plays the games of a cell for all probabilities at once, returns the cell and its wins (probabilities x [T, O, X]) """
+    pair_index, M, probs, run, iterations, seed = cell
+    strategy_pair = __strategy_pairs[pair_index]
+
+    wins = np.zeros((len(probs), 3), dtype=np.int64)
+    for game in range(iterations):
+        crn = game_crn(seed, COUPLED_TAG, pair_index, M, run, game)
+        for strategy in strategy_pair:
+            strategy.set_rng(crn)
+        winners = play_coupled_game(strategy_pair, M, np.asarray(probs), crn)
+        wins[np.arange(len(probs)), winners] += 1
+    return cell, wins
+
+
+def coupled_cells(strategy_pairs, board_sets, orders, p, iterations, num_runs, seed=0, workers=None, skip=()):
+    """ sweep_cells which plays every game once for all probabilities p, in cells of mode COUPLED """
+    # the results of the probabilities are correlated (see game.play_coupled_game). A (strategy_pair, M, run) is
+    # skipped if the cells of all probabilities are in skip, otherwise only the cells not in skip are yielded
+    def key(pair_index, M, prob, run):
+        return str(strategy_pairs[pair_index]), M, prob, run, iterations, seed, COUPLED
+
+    cells = [(pair_index, M, tuple(p), run, iterations, seed)
+             for run, pair_index, M in product(range(num_runs), range(len(strategy_pairs)), orders)
+             if not all(key(pair_index, M, prob, run) in skip for prob in p)]
+    for cell, wins in run_pool(run_coupled_cell, cells, strategy_pairs, board_sets, workers, "Running coupled simulations..."):
+        pair_index, M, _, run, _, _ = cell
+        for prob, prob_wins in zip(p, wins):
+            if key(pair_index, M, prob, run) not in skip:
+                yield strategy_pairs[pair_index], M, prob, run, {W: int(prob_wins[W]) for W in [X, O, T]}
+
+
+def run_tournament_cell(cell):
+    """ Plays the games of a cell for every strategy pair with common random numbers, returns the cell and its winners """
+    # game g of every pair, in both orders, uses the same CommonRandomNumbers. winners is an array (pairs x games)
+    M, prob_index, prob, run, iterations, seed = cell
+    caches = [SuperpositionCache() for _ in __strategy_pairs]
+
+    winners = np.empty((len(__strategy_pairs), iterations), dtype=np.int8)
+    for game in range(iterations):
+        crn = game_crn(seed, prob_index, run, game)
+        for pair_index, strategy_pair in enumerate(__strategy_pairs):
+            for strategy in strategy_pair:
+                strategy.set_rng(crn)
+                if isinstance(strategy, ClassicalWithMistakes):
+                    strategy.set_mistake_prob(prob)
+            winners[pair_index, game] = evaluate(play_cached_game(strategy_pair, M, caches[pair_index]), crn)
+    return cell, winners
+
+
+def tournament_cells(strategy_pairs, board_sets, orders, p, iterations, num_runs, seed=0, workers=None, skip=()):
+    """ Plays the cells of a tournament, yields (strategy_pair, M, prob, run, winners, difference) per cell not in skip """
+    # all pairs play a (M, prob, run) with common random numbers unless the cells (of mode TOURNAMENT) of all pairs are
+    # in skip. difference is the paired difference of the pair to strategy_pairs[0], see paired_differences
+    def key(strategy_pair, M, prob, run):
+        return str(strategy_pair), M, prob, run, iterations, seed, TOURNAMENT
+
+    cells = [(M, prob_index, prob, run, iterations, seed) 
+             for run, M, (prob_index, prob) in product(range(num_runs), orders, enumerate(p))
+             if not all(key(strategy_pair, M, prob, run) in skip for strategy_pair in strategy_pairs)]
+    for cell, winners in run_pool(run_tournament_cell, cells, strategy_pairs, board_sets, workers, "Running tournament..."):
+        M, _, prob, run, _, _ = cell
+        for strategy_pair, pair_winners, difference in zip(strategy_pairs, winners, paired_differences(winners)):
+            if key(strategy_pair, M, prob, run) not in skip:
+                yield strategy_pair, M, prob, run, pair_winners, difference
+
+
+def paired_differences(winners, reference=0):
+    """ Returns per strategy pair the mean, paired variance and independent variance of its tie rate minus reference's """
+    # the variances are per game, the independent variance is that of the difference if the games were independent
+    ties = (winners == T).astype(float)
+    differences = ties - ties[reference]
+    return [(differences[i].mean(), differences[i].var(ddof=1), ties[i].var(ddof=1) + ties[reference].var(ddof=1))
+            for i in range(len(ties))]
+
+
+def run_sweep(strategy_pairs, board_sets, orders, p, iterations, num_runs, seed=0, workers=None):
+    """ Plays all cells of a sweep, returns per run a dict with the wins {X, O, T} per (strategy_pair, M, prob) """
+    results_list = [dict() for _ in range(num_runs)]
+    for strategy_pair, M, prob, run, wins, _ in sweep_cells(strategy_pairs, board_sets, orders, p, iterations, num_runs,
+                                                            seed=seed, workers=workers):
+        results_list[run][(strategy_pair, M, prob)] = wins
+    return results_list
+
+
+def needs_refinement(curves, a, m, b, tolerance):
+    """ Returns whether any curve bends by more than tolerance at m, or two curves of the same M cross in [a, b] """
+    # curves is {(M, strategy_pair): {prob_index: ties}}, a curve bends by its distance to the line from a to b at m
+    for values in curves.values():
+        if abs(values[m] - (values[a] * (b - m) + values[b] * (m - a)) / (b - a)) > tolerance:
+            return True
+
+    for (M_1, pair_1), values_1 in curves.items():
+        for (M_2, pair_2), values_2 in curves.items():
+            differences = [values_1[i] - values_2[i] for i in [a, m, b]]
+            if M_1 == M_2 and min(differences) < 0 < max(differences):
+                return True
+    return False
+
+
+def refine_grid(evaluate, p, coarse_step, tolerance, curve_keys=None):
+    """ Evaluates the probabilities of the grid p adaptively, returns the sorted indices of the evaluated ones """
+    # starts with every [coarse_step]th probability and bisects (by index) the intervals on which the ties bend by more
+    # than tolerance or curves cross. evaluate(prob_indices) returns the results {(strategy_pair, M, prob): {W: (mean,
+    # std)}} of all probabilities evaluated so far. Only the curves (strategy_pair, M) in curve_keys are refined (None
+    # refines all), other results, e.g. of another spec in the same stream, are ignored
+    last = len(p) - 1
+    evaluated = sorted(set(range(0, last, coarse_step)) | {last})
+    results = evaluate(evaluated)
+    intervals = list(zip(evaluated[:-1], evaluated[1:]))
+
+    while True:
+        intervals = [(a, b) for a, b in intervals if b - a > 1]
+        if not intervals:
+            return sorted(evaluated)
+
+        middles = [(a + b) // 2 for a, b in intervals]
+        evaluated += middles
+        results = evaluate(middles)
+
+        # the tie curves of the pairs, by prob index
+        curves = dict()
+        for (strategy_pair, M, prob), score_dict in results.items():
+            if curve_keys is None or (strategy_pair, M) in curve_keys:
+                curves.setdefault((M, strategy_pair), dict())[prob] = score_dict[T][0]
+        curves = {curve: {i: values[p[i]] for i in evaluated} for curve, values in curves.items()}
+
+        intervals = [interval for a, b in intervals for interval in [(a, (a + b) // 2), ((a + b) // 2, b)]
+                     if needs_refinement(curves, a, (a + b) // 2, b, tolerance)]
+
+
+def combine_runs(results_list):
+    """ Combines the wins of the runs into their mean and std {X, O, T} per (strategy_pair, M, prob) """
+    combined_results = dict()
+    all_keys = set()
+    for results in results_list:
+        all_keys.update(results.keys())
+    for key in all_keys:
+        combined_results[key] = {M: (np.mean([results[key][M] for results in results_list]),
+                                     np.std([results[key][M] for results in results_list])) for M in [X, O, T]}
+    return combined_results
@@ -0,0 +1,71 @@
+import sys
+import time
+import numpy as np
+from constants import *
+from QuantumBoard import QuBoard, DenseQuBoard, Pruning
+from game import play_game, outcome_distribution
+from strategy import ClassicalWithMistakes, CommonRandomNumbers
+
+
+def truncation_effect(strategy_pair, M, prob, pruning, n_games, seed=0):
+    """
+    Plays n_games games of strategy_pair (with mistake probability prob) exactly and pruned by pruning, game g of both
+    with the same CommonRandomNumbers such that they make the same decisions where they can. Returns the mean outcome
+    probabilities {X, O, T} of the final superpositions of the exact and the pruned games, the mean total variation
+    distance between the outcomes of a game, the mean discarded probability per ply and the time per game of both on
+    the QuBoard backend.
+    """
+    for strategy in strategy_pair:
+        if isinstance(strategy, ClassicalWithMistakes):
+            strategy.set_mistake_prob(prob)
+
+    outcomes = {"exact": np.zeros(3), "pruned": np.zeros(3)}
+    distance = 0
+    for game in range(n_games):
+        game_outcomes = dict()
+        for name, game_pruning in [("exact", None), ("pruned", pruning)]:
+            crn = CommonRandomNumbers(np.random.SeedSequence(seed, spawn_key=(M, game)))
+            for strategy in strategy_pair:
+                strategy.set_rng(crn)
+            outcome = outcome_distribution(play_game(strategy_pair, M, backend=DenseQuBoard, pruning=game_pruning))
+            game_outcomes[name] = np.array([outcome[W] for W in [X, O, T]])
+            outcomes[name] += game_outcomes[name] / n_games
+        distance += np.abs(game_outcomes["exact"] - game_outcomes["pruned"]).sum() / 2 / n_games
+
+    # the cost of the moves is that of the sparse backend, whose superpositions are bounded by the pruning
+    seconds = dict()
+    for name, timing_pruning in [("exact", None), ("pruned", Pruning(pruning.threshold, pruning.top_k))]:
+        rng = np.random.default_rng(seed)
+        for strategy in strategy_pair:
+            strategy.set_rng(rng)
+        start = time.perf_counter()
+        for _ in range(n_games):
+            play_game(strategy_pair, M, backend=QuBoard, pruning=timing_pruning)
+        seconds[name] = (time.perf_counter() - start) / n_games
+
+    return {name: {W: outcomes[name][i] for i, W in enumerate([X, O, T])} for name in outcomes} | {
+        "distance": distance, "discarded": pruning.mean_discarded(), "seconds": seconds}
+
+
+def report(strategy_pairs, orders, prob, pruning, n_games=20, seed=0):
+    """ Prints the effect of pruning on the outcomes {X, O, T} of every strategy pair and order, see truncation_effect """
+    print(f"Truncation by {pruning} at mistake probability {prob}, {n_games} games")
+    print(f"{'pair':<70} {'M':>2} {'exact X/O/T':>20} {'pruned X/O/T':>20} {'distance':>9} {'discarded':>10} {'speedup':>8}")
+    for strategy_pair, M in [(strategy_pair, M) for strategy_pair in strategy_pairs for M in orders]:
+        effect = truncation_effect(strategy_pair, M, prob, Pruning(pruning.threshold, pruning.top_k), n_games, seed)
+        exact, pruned = ["/".join(f"{effect[name][W]:.3f}" for W in [X, O, T]) for name in ["exact", "pruned"]]
+        print(f"{str(strategy_pair):<70} {'X' if M == X else 'O':>2} {exact:>20} {pruned:>20} {effect['distance']:>9.4f} "
+              f"{effect['discarded'].sum():>10.4f} {effect['seconds']['exact'] / effect['seconds']['pruned']:>7.1f}x")
+        print(f"{'  discarded per ply':<70}    " + " ".join(f"{mass:.3f}" for mass in effect["discarded"]))
+
+
+if __name__ == "__main__":
+    # python truncation.py threshold [top_k] [games] [mistake probability], the report of the pairs of the thesis
+    import main
+    B_T, B_X, B_O, E = main.categorize_boards()
+    strategies = {name: cls(B_X, B_O, B_T, E) for name, cls in main.STRATEGIES.items()}
+    strategy_pairs = [tuple(strategies[name] for name in pair) for pair in main.DEFAULT_SPEC["strategy_pairs"][1:]]
+    threshold = float(sys.argv[1]) if len(sys.argv) > 1 else 0.001
+    top_k = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2] != "None" else None
+    report(strategy_pairs, [X, O], float(sys.argv[4]) if len(sys.argv) > 4 else 0.5, Pruning(threshold, top_k),
+           int(sys.argv[3]) if len(sys.argv) > 3 else 20)
@@ -1,13 +1,41 @@
+import inspect
+import json
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
+import unittest.mock
+import math
+from collections import Counter
+from itertools import permutations, product
+from math import ceil, floor, sqrt
 from constants import *
 
 import ClassicalBoard
 import QuantumBoard
 import helperFunctions
 import main
+import StateTable
+import batchEngine
+import game
+import sweep
+import resultStream
+import resultCache
+import truncation
+import benchmark
+import profiling
+import strategy
+import numpy as np
+import random
 
 class TestClassicalBoard(unittest.TestCase):
     def test_is_valid(self):
+        # tuples which are not boards are not mistaken for the board of their base-3 code
+        for board in [(5,0,0,0,0,0,0,0,0), (-1,1,0,0,0,0,0,0,0), (0,)*8, (0,)*10]:
+            self.assertFalse(QuantumBoard.Board.is_valid(board))
+            self.assertRaises(KeyError, StateTable.get_table().id, board)
+        self.assertRaises(Exception, QuantumBoard.Board, (5,0,0,0,0,0,0,0,0))
         self.assertTrue(QuantumBoard.Board.is_valid([0,0,0,
                                                      0,0,0,
                                                      0,0,0]))
@@ -65,17 +93,1035 @@ class TestClassicalBoard(unittest.TestCase):
                                                         O,O,0,
                                                         X,0,0]), (1, X))
 
+    def test_hash(self):
+        board = ClassicalBoard.Board((X,0,0,0,O,0,0,0,0))
+        self.assertEqual(board, ClassicalBoard.Board((X,0,0,0,O,0,0,0,0)))
+        self.assertNotEqual(board, ClassicalBoard.Board((X,O,0,0,0,0,0,0,0)))
+        self.assertIn(ClassicalBoard.Board((X,0,0,0,O,0,0,0,0)), {board: None})
+
+    def test_packed_board(self):
+        board = ClassicalBoard.Board((X,O,0,
+                                      0,X,0,
+                                      0,0,0))
+        self.assertFalse(hasattr(board, "__dict__"))
+        self.assertEqual(board.get_bits(), (0b10001, 0b10))
+        self.assertEqual(board.player_to_move(), O)
+        self.assertFalse(board.is_full())
+        self.assertTrue(ClassicalBoard.Board((X,O,X,X,O,O,O,X,X)).is_full())
+
+        table = StateTable.get_table()
+        for i, board in enumerate(table.boards):
+            self.assertEqual(ClassicalBoard.Board(board).get_board(), board)
+            self.assertEqual(ClassicalBoard.Board(board).player_to_move(), table.to_move[i])
+
+    def test_lines(self):
+        self.assertEqual(sorted(ClassicalBoard.lines(3, 3, 3)), 
+                         sorted([(0,1,2), (3,4,5), (6,7,8), (0,3,6), (1,4,7), (2,5,8), (0,4,8), (2,4,6)]))
+        self.assertEqual(len(ClassicalBoard.lines(4, 4, 4)), 10)
+        self.assertEqual(len(ClassicalBoard.lines(4, 4, 3)), 24)
+        self.assertEqual(len(ClassicalBoard.lines(3, 4, 3)), 14)
+
+    def test_symmetries(self):
+        self.assertEqual(len(set(ClassicalBoard.symmetries(3, 3))), 8)
+        self.assertEqual(len(set(ClassicalBoard.symmetries(3, 4))), 4)
+        
+        board = (X,O,0,
+                 0,0,0,
+                 0,0,0)
+        symmetric_boards = {tuple(board[i] for i in perm) for perm in ClassicalBoard.symmetries(3, 3)}
+        self.assertEqual(len(symmetric_boards), 8)
+        self.assertEqual({ClassicalBoard.Board.canonical(board) for board in symmetric_boards}, 
+                         {ClassicalBoard.Board.canonical(board)})
+
+class TestStateTable(unittest.TestCase):
+    def setUp(self):
+        self.table = StateTable.get_table()
+
+    def test_number_of_boards(self):
+        self.assertEqual(len(self.table), 5478)
+
+    def test_ids(self):
+        for i, board in enumerate(self.table.boards):
+            self.assertEqual(self.table.id(board), i)
+        self.assertNotIn((O,0,0,0,0,0,0,0,0), self.table)
+
+    def test_next_boards(self):
+        self.assertEqual(len(self.table.next_boards((0,0,0,0,0,0,0,0,0))), 9)
+        self.assertEqual(self.table.next_boards((X,X,X,
+                                                 O,O,0,
+                                                 0,0,0)), {(X,X,X,O,O,0,0,0,0)})
+        self.assertEqual(self.table.next_boards((X,O,X,
+                                                 X,O,O,
+                                                 O,X,X)), set())
+
+    def test_win_class(self):
+        self.assertEqual(self.table.win_class[self.table.id((0,0,0,0,0,0,0,0,0))], T)
+        self.assertEqual(self.table.win_class[self.table.id((X,X,0,
+                                                             O,O,0,
+                                                             0,0,0))], X)
+        self.assertEqual(self.table.win_class[self.table.id((X,X,0,
+                                                             O,0,0,
+                                                             0,0,0))], X)
+        self.assertEqual(self.table.win_class[self.table.id((X,0,0,
+                                                             0,0,0,
+                                                             0,0,0))], T)
+
+    def test_mistake_boards(self):
+        # after a corner opening every reply but the center loses
+        self.assertEqual(len(self.table.mistake_boards((X,0,0,
+                                                        0,0,0,
+                                                        0,0,0))), 7)
+        self.assertNotIn((X,0,0,0,O,0,0,0,0), self.table.mistake_boards((X,0,0,0,0,0,0,0,0)))
+        self.assertEqual(self.table.mistake_boards((X,X,0,
+                                                    O,O,0,
+                                                    0,0,0)), [])
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "states")
+            self.table.save(path)
+            cached_table = StateTable.StateTable.load(path)
+
+            self.assertEqual(list(cached_table.boards), list(self.table.boards))
+            self.assertEqual(list(cached_table.successors), list(self.table.successors))
+            self.assertEqual(list(cached_table.mistake_successors), list(self.table.mistake_successors))
+
+            # the cached arrays are memory-mapped and only the accessed boards are decoded
+            self.assertIsInstance(cached_table.codes, np.memmap)
+            self.assertEqual(cached_table.boards[5], self.table.boards[5])
+            self.assertEqual(cached_table.id(self.table.boards[5]), 5)
+            self.assertEqual(cached_table.id(list(self.table.boards[5])), 5)
+            self.assertEqual(cached_table.boards[3:6], [self.table.boards[i] for i in range(3, 6)])
+            self.assertEqual(cached_table.successors[-2:], [self.table.successors[i] for i in [-2, -1]])
+            self.assertEqual(cached_table.successors[-1], self.table.successors[len(self.table) - 1])
+            self.assertTrue((cached_table.win_class == self.table.win_class).all())
+
+            # a table cached with other rules is not loaded
+            with open(os.path.join(path, "rules.json"), "w") as f:
+                json.dump(dict(StateTable.rules(), size=16), f)
+            self.assertRaises(Exception, StateTable.StateTable.load, path)
+
+class TestPolicyMemo(unittest.TestCase):
+    def setUp(self):
+        B_T, B_X, B_O, E = main.categorize_boards()
+        self.classical = strategy.ClassicalWithMistakes(B_X, B_O, B_T, E)
+        self.classical.set_mistake_prob(0.5)
+
+    def test_repeated_board(self):
+        memo = strategy.PolicyMemo()
+        board = ClassicalBoard.Board((X,0,0,0,0,0,0,0,0))
+
+        move, _ = self.classical.classical_next_move(board, memo)
+        self.assertEqual((memo.hits, memo.misses), (0, 1))
+        for _ in range(10):
+            # the chosen move (or mistake) is repeated for an equal board
+            self.assertEqual(self.classical.classical_next_move(ClassicalBoard.Board(board.get_board()), memo)[0], move)
+        self.assertEqual((memo.hits, memo.misses), (10, 1))
+        self.assertAlmostEqual(memo.hit_rate(), 10/11)
+
+    def test_reset(self):
+        memo = strategy.PolicyMemo()
+        main.play_game((self.classical.no_mistakes_strategy, self.classical), X, prior_mappings=memo)
+        self.assertGreater(len(memo), 0)
+        lookups = memo.hits + memo.misses
+
+        memo.reset()
+        self.assertEqual(len(memo), 0)
+        self.assertEqual(memo.hits + memo.misses, lookups)
+
+class TestSuperpositionCache(unittest.TestCase):
+    def setUp(self):
+        B_T, B_X, B_O, E = main.categorize_boards()
+        self.classical = strategy.ClassicalWithMistakes(B_X, B_O, B_T, E)
+        self.classical.set_mistake_prob(0.1)
+        self.quantum = strategy.QuantumFullAmplification(B_X, B_O, B_T, E)
+
+    def test_matches_uncached_games(self):
+        for M in [X, O]:
+            cache = strategy.SuperpositionCache()
+            self.classical.set_rng(np.random.default_rng(0))
+            cached = [main.play_cached_game((self.quantum, self.classical), M, cache).get_decomp() for _ in range(30)]
+            self.classical.set_rng(np.random.default_rng(0))
+            uncached = [main.play_game((self.quantum, self.classical), M, backend=QuantumBoard.DenseQuBoard).get_decomp() 
+                        for _ in range(30)]
+            self.assertEqual(cached, uncached)
+            self.assertGreater(cache.hits, 0)
+
+    def test_measuring_keeps_cache(self):
+        cache = strategy.SuperpositionCache()
+        self.classical.set_rng(np.random.default_rng(0))
+        main.evaluate(main.play_cached_game((self.quantum, self.classical), X, cache), np.random.default_rng(0))
+        for board, _ in cache.superpositions.values():
+            self.assertAlmostEqual(board.get_probs().sum(), 1)
+        self.assertGreater(len(cache.superpositions[()][0].get_decomp()), 1)
+
+    def test_lru_eviction(self):
+        boards = [QuantumBoard.DenseQuBoard() for _ in range(3)]
+        cache = strategy.SuperpositionCache(max_bytes=2 * boards[0].get_probs().nbytes)
+        cache[(1,)], cache[(2,)] = (boards[0], 0), (boards[1], 0)
+        self.assertEqual(cache.get((1,)), (boards[0], 0))
+        cache[(3,)] = (boards[2], 0)  # evicts the least recently used (2,)
+        self.assertIsNone(cache.get((2,)))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 2 * boards[0].get_probs().nbytes)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertAlmostEqual(cache.hit_rate(), 0.5)
+        cache[(3,)] = (boards[2], 1)  # replacing an entry does not count its bytes twice
+        self.assertEqual((len(cache), cache.nbytes), (2, 2 * boards[0].get_probs().nbytes))
+
+class TestCompiledPolicy(unittest.TestCase):
+    def setUp(self):
+        self.board_sets = main.categorize_boards()
+        B_T, B_X, B_O, E = self.board_sets
+        self.classical = strategy.ClassicalWithMistakes(B_X, B_O, B_T, E)
+        self.table = StateTable.get_table()
+
+    def test_shared(self):
+        B_T, B_X, B_O, E = self.board_sets
+        self.assertIs(self.classical.policy, strategy.ClassicalWithMistakes(B_X, B_O, B_T, E).policy)
+        self.assertIs(self.classical.no_mistakes_strategy.policy, strategy.QuantumFullAmplification(B_X, B_O, B_T, E).policy)
+        self.assertIsNot(self.classical.policy, self.classical.no_mistakes_strategy.policy)
+        self.assertRaises(ValueError, self.classical.policy.good_weights.__setitem__, 0, 1)
+
+    def test_transition(self):
+        policy = self.classical.policy
+        self.assertIs(policy.transition(0), policy.good)
+        probs = np.zeros(len(self.table))
+        probs[self.table.id((X,0,0,0,0,0,0,0,0))] = 1
+
+        # after a corner opening 1 of the 8 replies is good and the 7 others are mistakes
+        next_probs = policy.transition(0.5).apply(probs)
+        self.assertAlmostEqual(next_probs.sum(), 1)
+        self.assertAlmostEqual(next_probs[self.table.id((X,0,0,0,O,0,0,0,0))], 0.5)
+        for board in self.table.mistake_boards((X,0,0,0,0,0,0,0,0)):
+            self.assertAlmostEqual(next_probs[self.table.id(board)], 0.5 / 7)
+
+class TestSymmetricStateTable(unittest.TestCase):
+    def setUp(self):
+        self.table = StateTable.get_table()
+        self.symmetric_table = StateTable.StateTable(symmetric=True)
+
+    def test_number_of_boards(self):
+        self.assertEqual(len(self.symmetric_table), 765)
+        for board in self.symmetric_table.boards:
+            self.assertEqual(ClassicalBoard.Board.canonical(board), board)
+
+    def test_matches_full_table(self):
+        canonical = ClassicalBoard.Board.canonical
+        for i, board in enumerate(self.table.boards):
+            j = self.symmetric_table.id(board)
+            self.assertEqual(self.symmetric_table.boards[j], canonical(board))
+            self.assertEqual(self.symmetric_table.win_class[j], self.table.win_class[i])
+
+            # the successors of the canonical board are the canonical successors, with their multiplicities
+            for successors in ["good_successors", "mistake_successors"]:
+                self.assertEqual(Counter(canonical(self.table.boards[k]) for k in getattr(self.table, successors)[i]),
+                                 Counter(self.symmetric_table.boards[k] for k in getattr(self.symmetric_table, successors)[j]))
+
+    def test_dense_decomposition(self):
+        # symmetric boards share the id of their canonical board, their probabilities add up
+        with unittest.mock.patch.object(QuantumBoard, "get_table", return_value=self.symmetric_table):
+            quboard = QuantumBoard.DenseQuBoard({(X,0,0,0,0,0,0,0,0): 0.25, (0,0,X,0,0,0,0,0,0): 0.25, (0,0,0,0,X,0,0,0,0): 0.5})
+            self.assertEqual(quboard.get_decomp(), {ClassicalBoard.Board.canonical((X,0,0,0,0,0,0,0,0)): 0.5, 
+                                                    (0,0,0,0,X,0,0,0,0): 0.5})
+
+    def test_other_board_sizes(self):
+        # the rules are read at import, so a 3 x 4 board with 3 in a line is played in a new interpreter
+        script = "import main\n" \
+                 "from constants import *\n" \
+                 "B_T, B_X, B_O, E = main.categorize_boards()\n" \
+                 "pair = (main.QuantumFullAmplification(B_X, B_O, B_T, E), main.ClassicalWithMistakes(B_X, B_O, B_T, E))\n" \
+                 "pair[1].set_mistake_prob(0.5)\n" \
+                 "print(SIZE, main.get_table().win_class[0], main.evaluate(main.play_game(pair, X, main.DenseQuBoard)))\n"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            env = dict(os.environ, TTT_ROWS="3", TTT_COLS="4", TTT_K="3", TTT_SYMMETRIC="1", TTT_CACHE_DIR=tmp_dir)
+            output = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, 
+                                    cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout
+
+        # the first player wins on a 3 x 4 board with 3 in a line
+        self.assertEqual(output.split(), [str(12), str(X), str(X)])
+
+class TestBatchEngine(unittest.TestCase):
+    def setUp(self):
+        B_T, B_X, B_O, E = main.categorize_boards()
+        self.strategy_pair = (strategy.ClassicalWithoutMistakes(B_X, B_O, B_T, E), 
+                              strategy.ClassicalWithMistakes(B_X, B_O, B_T, E))
+        self.rng = np.random.default_rng(0)
+
+    def test_supports(self):
+        B_T, B_X, B_O, E = main.categorize_boards()
+        self.assertTrue(batchEngine.supports(self.strategy_pair))
+        self.assertFalse(batchEngine.supports((strategy.QuantumEqualSuperposition(B_X, B_O, B_T, E), self.strategy_pair[1])))
+
+    def test_deterministic_outcomes(self):
+        self.strategy_pair[1].set_mistake_prob(0)
+        self.assertEqual(batchEngine.play_classical_batch(self.strategy_pair, X, 1000, self.rng), {X: 0, O: 0, T: 1000})
+        self.strategy_pair[1].set_mistake_prob(1)
+        self.assertEqual(batchEngine.play_classical_batch(self.strategy_pair, X, 1000, self.rng), {X: 1000, O: 0, T: 0})
+
+    def test_matches_single_games(self):
+        random.seed(0)
+        self.strategy_pair[1].set_mistake_prob(0.3)
+        n_games, n_batch_games = 1000, 20000
+
+        single = {X: 0, O: 0, T: 0}
+        for _ in range(n_games):
+            single[main.evaluate(main.play_game(self.strategy_pair, O))] += 1
+        batch = batchEngine.play_classical_batch(self.strategy_pair, O, n_batch_games, self.rng)
+
+        self.assertEqual(sum(batch.values()), n_batch_games)
+        for W in [X, O, T]:
+            self.assertAlmostEqual(single[W] / n_games, batch[W] / n_batch_games, delta=0.08)
+
+class SweepCase(unittest.TestCase):
+    """ Base of the tests of sweeps, with two strategy pairs """
+    def setUp(self):
+        self.board_sets = main.categorize_boards()
+        B_T, B_X, B_O, E = self.board_sets
+        classical_with_mistakes = strategy.ClassicalWithMistakes(B_X, B_O, B_T, E)
+        self.strategy_pairs = [(strategy.ClassicalWithoutMistakes(B_X, B_O, B_T, E), classical_with_mistakes), 
+                               (strategy.QuantumFullAmplification(B_X, B_O, B_T, E), classical_with_mistakes)]
+
+    def run_sweep(self, seed, workers):
+        return sweep.run_sweep(self.strategy_pairs, self.board_sets, [X, O], [0, 0.5], 20, 2, seed=seed, workers=workers)
+
+class TestSweep(SweepCase):
+    def test_results(self):
+        results_list = self.run_sweep(0, 2)
+        self.assertEqual(len(results_list), 2)
+        for results in results_list:
+            self.assertEqual(len(results), 8)
+            for (strategy_pair, M, prob), wins in results.items():
+                self.assertIn(strategy_pair, self.strategy_pairs)
+                self.assertEqual(sum(wins.values()), 20)
+                if prob == 0:
+                    self.assertEqual(wins[T], 20)
+
+        combined_results = sweep.combine_runs(results_list)
+        self.assertEqual(combined_results.keys(), results_list[0].keys())
+
+    def test_deterministic_seeding(self):
+        self.assertEqual(self.run_sweep(0, 1), self.run_sweep(0, 3))
+        self.assertNotEqual(self.run_sweep(0, 2), self.run_sweep(1, 2))
+
+class TestAdaptiveSampling(SweepCase):
+    def test_stops_when_precise(self):
+        sampling = (0.02, 50, 2000)
+        cells = {(M, prob): wins for _, M, prob, _, wins, _ in 
+                 sweep.sweep_cells(self.strategy_pairs[:1], self.board_sets, [X, O], [0, 0.5], 20, 5, workers=1, sampling=sampling)}
+        self.assertEqual(len(cells), 4)  # a single run per cell
+        for (M, prob), wins in cells.items():
+            self.assertLessEqual(sum(wins.values()), 2000)
+            self.assertTrue(sweep.tie_rate_se(wins) <= 0.02 or sum(wins.values()) == 2000)
+        # deterministic ties need fewer games than a tie rate around one half
+        self.assertLess(sum(cells[(X, 0)].values()), sum(cells[(X, 0.5)].values()))
+
+    def test_tie_rate_se(self):
+        self.assertGreater(sweep.tie_rate_se({X: 0, O: 0, T: 50}), 0)
+        self.assertEqual(sweep.tie_rate_se({X: 0, O: 0, T: 0}), float("inf"))
+        self.assertAlmostEqual(sweep.tie_rate_se({X: 49, O: 0, T: 49}), sqrt(0.25 / 98))
+
+    def test_aggregate(self):
+        path = os.path.join(tempfile.mkdtemp(), "results.jsonl")
+        with resultStream.ResultWriter(path) as writer:
+            writer.write_cell(self.strategy_pairs[0], X, 0.5, 0, 100, 0, {X: 300, O: 100, T: 600}, resultStream.sweep_mode((0.01, 100, 5000)))
+        mean, std = resultStream.aggregate(path)[(str(self.strategy_pairs[0]), X, 0.5)][T]
+        self.assertAlmostEqual(mean, 60)
+        self.assertAlmostEqual(std, sqrt(100 * 0.6 * 0.4))
+
+class TestAdaptiveGrid(unittest.TestCase):
+    def refine(self, curves, coarse_step=10, tolerance=1):
+        p = [0.01 * i for i in range(101)]
+        results = {("stale", X, p[3]): {T: (0, 0)}}  # a pair of another spec, evaluated at other probabilities
+
+        def evaluate(prob_indices):
+            for i in prob_indices:
+                for (pair, M), curve in curves.items():
+                    results[(pair, M, p[i])] = {T: (curve(p[i]), 0)}
+            return results
+
+        evaluated = sweep.refine_grid(evaluate, p, coarse_step, tolerance, curve_keys=curves.keys())
+        self.assertEqual(len(results), len(curves) * len(evaluated) + 1)
+        return evaluated
+
+    def test_straight_curve(self):
+        # only the coarse grid and its (straight) middles are evaluated
+        self.assertEqual(self.refine({("a", X): lambda prob: 350 * (1 - prob)}), list(range(0, 101, 5)))
+
+    def test_bend(self):
+        evaluated = self.refine({("a", X): lambda prob: 350 * max(1 - 3 * prob, 0)})
+        self.assertIn(33, evaluated)
+        self.assertIn(34, evaluated)
+        self.assertLess(len(evaluated), 40)
+
+    def test_crossing(self):
+        curves = {("a", X): lambda prob: 100 * prob, ("b", X): lambda prob: 57 - 0.1 * prob, ("c", O): lambda prob: 0}
+        evaluated = self.refine(curves, tolerance=100)  # the curves cross between 0.56 and 0.57
+        self.assertIn(56, evaluated)
+        self.assertIn(57, evaluated)
+
+class TestTournament(unittest.TestCase):
+    def setUp(self):
+        self.board_sets = main.categorize_boards()
+        B_T, B_X, B_O, E = self.board_sets
+        self.classical = [strategy.ClassicalWithMistakes(B_X, B_O, B_T, E) for _ in range(2)]
+        self.table = StateTable.get_table()
+
+    def test_common_decisions(self):
+        states = np.array([self.table.id((X,0,0,0,0,0,0,0,0)), self.table.id((0,0,0,0,X,0,0,0,0))])
+        picks = []
+        for classical in self.classical:
+            classical.set_mistake_prob(0.5)
+            crn = strategy.CommonRandomNumbers(np.random.SeedSequence(0, spawn_key=(1,)))
+            picks.append(classical.policy.pick(states, crn, 0.5))
+        np.testing.assert_array_equal(picks[0], picks[1])
+
+    def test_tournament(self):
+        B_T, B_X, B_O, E = self.board_sets
+        strategy_pairs = [(strategy.ClassicalWithoutMistakes(B_X, B_O, B_T, E), self.classical[0]), 
+                          (strategy.ClassicalWithoutMistakes(B_X, B_O, B_T, E), self.classical[1])]
+        cells = list(sweep.tournament_cells(strategy_pairs, self.board_sets, [X], [0, 0.5], 30, 1, workers=1))
+        self.assertEqual(len(cells), 4)
+        for prob in [0, 0.5]:
+            (_, _, _, _, winners_0, _), (_, _, _, _, winners_1, difference) = [cell for cell in cells if cell[2] == prob]
+            # the same strategies given the same random numbers play the same games
+            self.assertEqual(winners_0.shape, (30,))
+            np.testing.assert_array_equal(winners_0, winners_1)
+            self.assertEqual(difference[:2], (0, 0))
+            if prob == 0:
+                self.assertTrue((winners_0 == T).all())
+
+    def test_skip(self):
+        # only the cells of the pairs which are not in skip are yielded, the cells of completed pairs are not rewritten
+        B_T, B_X, B_O, E = self.board_sets
+        strategy_pairs = [(strategy.ClassicalWithoutMistakes(B_X, B_O, B_T, E), self.classical[0]), 
+                          (self.classical[1], strategy.ClassicalWithoutMistakes(B_X, B_O, B_T, E))]
+        skip = {(str(strategy_pairs[0]), X, prob, 0, 30, 0, resultStream.TOURNAMENT) for prob in [0, 0.5]}
+        cells = list(sweep.tournament_cells(strategy_pairs, self.board_sets, [X], [0, 0.5], 30, 1, workers=1, skip=skip))
+        self.assertEqual([(cell[0], cell[2]) for cell in cells], [(strategy_pairs[1], 0), (strategy_pairs[1], 0.5)])
+        skip |= {(str(strategy_pairs[1]), X, prob, 0, 30, 0, resultStream.TOURNAMENT) for prob in [0, 0.5]}
+        self.assertEqual(list(sweep.tournament_cells(strategy_pairs, self.board_sets, [X], [0, 0.5], 30, 1, skip=skip)), [])
+
+    def test_measurement(self):
+        # the measurement uses the number of the CommonRandomNumbers for it, not a draw of their generator
+        first, second = sorted([self.table.id((X,X,0,O,O,0,0,0,0)), self.table.id((X,X,X,O,O,0,0,0,0))])
+        crn = strategy.CommonRandomNumbers(np.random.SeedSequence(0))
+        state = crn.rng.bit_generator.state
+        for measurement, expected in [(0.25, first), (0.75, second)]:
+            crn.measurement = measurement
+            for backend in [QuantumBoard.QuBoard, QuantumBoard.DenseQuBoard]:
+                board = backend({self.table.boards[first]: 0.5, self.table.boards[second]: 0.5})
+                self.assertEqual(board.measure(None, measurement).get_board(), self.table.boards[expected])
+                board = backend({self.table.boards[first]: 0.5, self.table.boards[second]: 0.5})
+                self.assertEqual(game.evaluate(board, crn), T if expected == first else X)
+        self.assertEqual(crn.rng.bit_generator.state, state)
+
+    def test_fields(self):
+        # the numbers of a board do not depend on which other boards are asked for, and differ between the fields
+        crn = strategy.CommonRandomNumbers(np.random.SeedSequence(0))
+        states = np.arange(len(self.table))
+        fields = crn.fields(states)
+        self.assertEqual(fields.shape, (3, len(self.table)))
+        np.testing.assert_array_equal(crn.fields(states[::7], 1), fields[1, ::7])
+        self.assertTrue(((0 <= fields) & (fields < 1)).all())
+        self.assertAlmostEqual(fields.mean(), 0.5, delta=0.01)
+        self.assertFalse(np.array_equal(fields, strategy.CommonRandomNumbers(np.random.SeedSequence(1)).fields(states)))
+
+    def test_paired_differences(self):
+        winners = np.array([[T, T, X, O], [T, X, X, T]])
+        (mean_0, var_0, _), (mean_1, var_1, independent_var_1) = sweep.paired_differences(winners)
+        self.assertEqual((mean_0, var_0), (0, 0))
+        self.assertAlmostEqual(mean_1, 0)
+        self.assertAlmostEqual(var_1, np.var([0, -1, 0, 1], ddof=1))
+        self.assertAlmostEqual(independent_var_1, 2 * np.var([1, 1, 0, 0], ddof=1))
+
+class TestCoupledSweep(unittest.TestCase):
+    def setUp(self):
+        self.board_sets = main.categorize_boards()
+        B_T, B_X, B_O, E = self.board_sets
+        self.strategy_pairs = [(strategy.ClassicalWithoutMistakes(B_X, B_O, B_T, E), strategy.ClassicalWithMistakes(B_X, B_O, B_T, E)),
+                               (strategy.QuantumFullAmplification(B_X, B_O, B_T, E), strategy.ClassicalWithMistakes(B_X, B_O, B_T, E))]
+
+    def crn(self, game_index):
+        return strategy.CommonRandomNumbers(np.random.SeedSequence(0, spawn_key=(game_index,)))
+
+    def test_same_as_single_games(self):
+        probs = np.linspace(0, 1, 11)
+        for strategy_pair, M, game_index in product(self.strategy_pairs, [X, O], range(3)):
+            crn = self.crn(game_index)
+            for s in strategy_pair:
+                s.set_rng(crn)
+            winners = game.play_coupled_game(strategy_pair, M, probs, crn)
+            for prob, winner in zip(probs, winners):
+                crn = self.crn(game_index)
+                for s in strategy_pair:
+                    s.set_rng(crn)
+                strategy_pair[1].set_mistake_prob(prob)
+                self.assertEqual(winner, game.evaluate(game.play_game(strategy_pair, M, backend=QuantumBoard.DenseQuBoard), crn))
+
+    def test_coupled_cells(self):
+        cells = list(sweep.coupled_cells(self.strategy_pairs[:1], self.board_sets, [X], [0, 0.5, 1], 20, 1, workers=1))
+        self.assertEqual([prob for _, _, prob, _, _ in cells], [0, 0.5, 1])
+        for strategy_pair, M, prob, run, wins in cells:
+            self.assertEqual(sum(wins.values()), 20)
+            if prob == 0:
+                self.assertEqual(wins[T], 20)
+
+        # the coupled cells are not the independent cells of the same spec, neither skips the other
+        independent = {(str(self.strategy_pairs[0]), X, prob, 0, 20, 0, resultStream.INDEPENDENT) for prob in [0, 0.5, 1]}
+        self.assertEqual(len(list(sweep.coupled_cells(self.strategy_pairs[:1], self.board_sets, [X], [0, 0.5, 1], 20, 1, 
+                                                      workers=1, skip=independent))), 3)
+        coupled = {(str(self.strategy_pairs[0]), X, prob, 0, 20, 0, resultStream.COUPLED) for prob in [0, 0.5]}
+        cells = list(sweep.coupled_cells(self.strategy_pairs[:1], self.board_sets, [X], [0, 0.5, 1], 20, 1, workers=1,
+                                         skip=coupled))
+        self.assertEqual([prob for _, _, prob, _, _ in cells], [1])
+
+class TestResultStream(SweepCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(tempfile.mkdtemp(), "results.jsonl")
+
+    def stream_sweep(self, num_runs):
+        completed = resultStream.completed_cells(self.path)
+        cells = list(sweep.sweep_cells(self.strategy_pairs, self.board_sets, [X, O], [0, 0.5], 20, num_runs, workers=1,
+                                       skip=completed))
+        with resultStream.ResultWriter(self.path) as writer:
+            for strategy_pair, M, prob, run, wins, _ in cells:
+                writer.write_cell(strategy_pair, M, prob, run, 20, 0, wins)
+        return cells
+
+    def test_resume(self):
+        self.assertEqual(len(self.stream_sweep(1)), 8)
+        with open(self.path, "a") as f:
+            f.write('{"pair": "cut off')  # a crash while writing a line
+
+        # only the cells of the new run are played, with the same results as an uninterrupted sweep
+        self.assertEqual(len(self.stream_sweep(2)), 8)
+        self.assertEqual(self.stream_sweep(2), [])
+        self.assertEqual(resultStream.aggregate(self.path), 
+                         {(str(pair), M, prob): results for (pair, M, prob), results in 
+                          sweep.combine_runs(self.run_sweep(0, 1)).items()})
+
+    def test_exact_records(self):
+        with resultStream.ResultWriter(self.path) as writer:
+            writer.write_exact(self.strategy_pairs[0], X, 0.5, 100, {X: 0.2, O: 0, T: 0.8})
+        mean, std = resultStream.aggregate(self.path)[(str(self.strategy_pairs[0]), X, 0.5)][T]
+        self.assertAlmostEqual(mean, 80)
+        self.assertAlmostEqual(std, 4)
+
+    def test_specs(self):
+        # a stream with the cells of two specs (iterations), and a cell which is in it twice
+        pair = self.strategy_pairs[0]
+        with resultStream.ResultWriter(self.path) as writer:
+            writer.write_cell(pair, X, 0.5, 0, 20, 0, {X: 0, O: 4, T: 16})
+            writer.write_cell(pair, X, 0.5, 0, 20, 0, {X: 0, O: 4, T: 16})
+            writer.write_cell(pair, X, 0.5, 1, 20, 0, {X: 0, O: 2, T: 18})
+            writer.write_cell(pair, X, 0.5, 0, 100, 0, {X: 0, O: 50, T: 50})
+            writer.write_cell(pair, X, 0.5, 0, 20, 0, {X: 0, O: 40, T: 60}, resultStream.sweep_mode((0.01, 50, 100)))
+        self.assertRaises(Exception, resultStream.aggregate, self.path)
+
+        # adaptively sampled and fixed cells of the same run are different cells
+        self.assertEqual(len(resultStream.completed_cells(self.path)), 4)
+        cells = {(str(pair), X, 0.5, run, 20, 0, resultStream.INDEPENDENT) for run in range(2)}
+        mean, std = resultStream.aggregate(self.path, cells)[(str(pair), X, 0.5)][T]
+        self.assertAlmostEqual(mean, 17)
+        self.assertAlmostEqual(std, 1)
+
+class TestResultCache(SweepCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = resultCache.ResultCache(os.path.join(tempfile.mkdtemp(), "results"))
+
+    def test_key(self):
+        key = self.cache.key(self.strategy_pairs[0], M=X, prob=0.5, iterations=20, seed=0)
+        self.assertEqual(key, self.cache.key(self.strategy_pairs[0], M=X, prob=0.5, iterations=20, seed=0))
+        self.assertNotEqual(key, self.cache.key(self.strategy_pairs[1], M=X, prob=0.5, iterations=20, seed=0))
+        self.assertNotEqual(key, self.cache.key(self.strategy_pairs[0], M=O, prob=0.5, iterations=20, seed=0))
+        self.assertNotEqual(key, self.cache.key(self.strategy_pairs[0], M=X, prob=0.5, iterations=20, seed=1))
+
+        # a change of a strategy class (its source) or of its parameters invalidates the cells of that strategy only
+        fingerprints = {cls: resultCache.class_fingerprint(cls) for cls in resultCache.strategy_classes()}
+        self.assertEqual(len(set(fingerprints.values())), len(fingerprints))
+        quantum_key = self.cache.key(self.strategy_pairs[1], M=X, prob=0.5, iterations=20, seed=0)
+        with unittest.mock.patch.object(resultCache, "class_fingerprint", 
+                                        lambda cls: "changed" if cls is strategy.QuantumFullAmplification else fingerprints[cls]):
+            self.assertEqual(key, self.cache.key(self.strategy_pairs[0], M=X, prob=0.5, iterations=20, seed=0))
+            self.assertNotEqual(quantum_key, self.cache.key(self.strategy_pairs[1], M=X, prob=0.5, iterations=20, seed=0))
+        self.strategy_pairs[0][0].depth = 2
+        self.assertNotEqual(key, self.cache.key(self.strategy_pairs[0], M=X, prob=0.5, iterations=20, seed=0))
+
+        # a class is also invalidated by a change of the strategy classes it composes
+        self.assertIn(strategy.ClassicalWithoutMistakes, resultCache.used_classes(strategy.ClassicalWithMistakes))
+        self.assertNotIn(strategy.ClassicalWithMistakes, resultCache.used_classes(strategy.ClassicalWithoutMistakes))
+        getsource = inspect.getsource
+        with unittest.mock.patch.object(resultCache.inspect, "getsource", 
+                                        lambda obj: getsource(obj) + "# changed" if obj is strategy.ClassicalWithoutMistakes else getsource(obj)):
+            self.assertNotEqual(resultCache.class_fingerprint.__wrapped__(strategy.ClassicalWithMistakes), 
+                                fingerprints[strategy.ClassicalWithMistakes])
+            self.assertEqual(resultCache.class_fingerprint.__wrapped__(strategy.QuantumFullAmplification), 
+                             fingerprints[strategy.QuantumFullAmplification])
+
+    def test_get_and_evict(self):
+        self.assertIsNone(self.cache.get("missing"))
+        for i in range(10):
+            self.cache[f"key{i}"] = {"wins": {"0": i}, "padding": "x" * 100}
+            os.utime(self.cache.file(f"key{i}"), (i, i))
+        self.assertEqual(self.cache.get("key3"), {"wins": {"0": 3}, "padding": "x" * 100})
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        # the least recently used results are removed first
+        self.cache.max_bytes = 3 * os.path.getsize(self.cache.file("key0"))
+        self.cache.evict()
+        self.assertEqual(sorted(os.listdir(self.cache.path)), ["key3.json", "key8.json", "key9.json"])
+
+        # a result removed by a concurrent sweep between listing and stat is skipped
+        vanished = unittest.mock.Mock(path=self.cache.file("vanished"), stat=unittest.mock.Mock(side_effect=FileNotFoundError))
+        vanished.name = "vanished.json"
+        entries = list(os.scandir(self.cache.path)) + [vanished]
+        self.cache.max_bytes = os.path.getsize(self.cache.file("key3"))
+        with unittest.mock.patch.object(resultCache.os, "scandir", lambda path: entries):
+            self.cache.evict()
+        self.assertEqual(os.listdir(self.cache.path), ["key3.json"])  # the most recently used (by get)
+
+class TestBenchmark(unittest.TestCase):
+    def test_compare(self):
+        baseline = {"a": {"ops_per_sec": 100}, "b": {"ops_per_sec": 100}, "c": {"ops_per_sec": 100}}
+        results = {"a": {"ops_per_sec": 85}, "b": {"ops_per_sec": 75}, "c": {"ops_per_sec": 150}, "d": {"ops_per_sec": 1}}
+        self.assertEqual(benchmark.compare(results, baseline, 0.2), ["b"])
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.enabled, self.timers, self.counters = profiling.ENABLED, dict(profiling.timers), dict(profiling.counters)
+        profiling.timers.clear()
+        profiling.counters.clear()
+
+    def tearDown(self):
+        profiling.ENABLED = self.enabled
+        profiling.timers.clear()
+        profiling.timers.update(self.timers)
+        profiling.counters.clear()
+        profiling.counters.update(self.counters)
+
+    def test_disabled(self):
+        profiling.ENABLED = False
+        func = lambda: 1
+        self.assertIs(profiling.timed(func), func)
+        with profiling.phase("phase"):
+            func()
+        self.assertEqual(profiling.timers, dict())
+        self.assertIsNone(profiling.take())
+
+    def test_timers(self):
+        profiling.ENABLED = True
+        func = profiling.timed(helperFunctions.replace)
+        for _ in range(3):
+            self.assertEqual(func((0, 0), 1, X), (0, X))
+        with profiling.phase("phase"):
+            pass
+        profiling.count("cache hits", 3)
+        profiling.count("cache misses")
+
+        taken = profiling.take()
+        self.assertEqual(taken[0]["replace"][0], 3)
+        self.assertEqual(taken[0]["phase"][0], 1)
+        self.assertEqual(taken[1], {"cache hits": 3, "cache misses": 1})
+        self.assertEqual((profiling.timers, profiling.counters), (dict(), dict()))
+        profiling.merge(taken)
+        profiling.merge(taken)
+        self.assertEqual(profiling.timers["replace"][0], 6)
+        self.assertEqual(profiling.counters["cache hits"], 6)
+        self.assertIn("replace", profiling.summary())
+        self.assertIn("cache hit rate", profiling.summary())
+        self.assertIn("75.0%", profiling.summary())
+
 class TestQuantumBoard(unittest.TestCase):
     def test_test(self):
         self.assertTrue(True)
 
+class TestMeasure(unittest.TestCase):
+    def setUp(self):
+        self.decomp = {(X,0,0,0,0,0,0,0,0): 0.25, (0,0,0,0,X,0,0,0,0): 0.75}
+
+    def test_drifted_total(self):
+        # a total below the draw used to recurse, the draws are relative to the total
+        for backend in [QuantumBoard.QuBoard, QuantumBoard.DenseQuBoard]:
+            drifted = {board: a * 0.9 for board, a in self.decomp.items()}
+            if backend is QuantumBoard.DenseQuBoard:
+                drifted = QuantumBoard.DenseQuBoard(self.decomp).get_probs() * 0.9
+            for bench in [0, 0.5, 0.99999]:
+                rng = unittest.mock.Mock(random=lambda k: np.full(k, bench))
+                self.assertIn(backend.trusted(drifted).measure(rng).get_board(), self.decomp)
+
+    def test_sample(self):
+        for backend in [QuantumBoard.QuBoard, QuantumBoard.DenseQuBoard]:
+            quboard = backend(dict(self.decomp))
+            samples = Counter(board.get_board() for board in quboard.sample(4000, np.random.default_rng(0)))
+            self.assertAlmostEqual(samples[(0,0,0,0,X,0,0,0,0)] / 4000, 0.75, delta=0.03)
+            self.assertEqual(quboard.get_decomp().keys(), self.decomp.keys())  # not collapsed
+
+            # the cached distribution follows an amplification
+            quboard.amplify({(X,0,0,0,0,0,0,0,0)}, n=1)
+            samples = Counter(board.get_board() for board in quboard.sample(100, np.random.default_rng(0)))
+            self.assertEqual(samples[(X,0,0,0,0,0,0,0,0)], 100)
+
+    def test_sample_outcomes(self):
+        quboard = QuantumBoard.QuBoard({(X,X,X,O,O,0,0,0,0): 0.5, (X,O,X,X,O,O,O,X,X): 0.5})
+        wins = main.sample_outcomes(quboard, 1000, np.random.default_rng(0))
+        self.assertEqual(wins[O], 0)
+        self.assertEqual(wins[X] + wins[T], 1000)
+        self.assertAlmostEqual(wins[X] / 1000, 0.5, delta=0.05)
+
+    def test_sum(self):
+        other = QuantumBoard.QuBoard({(X,0,0,0,0,0,0,0,0): 1})
+        decomp = QuantumBoard.QuBoard.sum([QuantumBoard.QuBoard(dict(self.decomp)), other]).get_decomp()
+        self.assertAlmostEqual(decomp[(X,0,0,0,0,0,0,0,0)], 0.625)
+        self.assertAlmostEqual(decomp[(0,0,0,0,X,0,0,0,0)], 0.375)
+
+    def test_normalize(self):
+        quboard = QuantumBoard.QuBoard({board: a * (1 + 1e-6) for board, a in self.decomp.items()})
+        self.assertEqual(math.fsum(quboard.get_decomp().values()), 1)
+
+class TestDenseQuBoard(unittest.TestCase):
+    def setUp(self):
+        self.B_T, self.B_X, self.B_O, self.E = main.categorize_boards()
+        self.quantum = strategy.QuantumEqualSuperposition(self.B_X, self.B_O, self.B_T, self.E)
+
+    def assertDecompEqual(self, decomp, other_decomp):
+        self.assertEqual(decomp.keys(), other_decomp.keys())
+        for board in decomp.keys():
+            self.assertAlmostEqual(decomp[board], other_decomp[board])
+
+    def test_decomp_view(self):
+        decomp = {(X,0,0,0,0,0,0,0,0): 0.25, (0,0,0,0,X,0,0,0,0): 0.75}
+        self.assertTrue(QuantumBoard.DenseQuBoard().is_empty())
+        self.assertDecompEqual(QuantumBoard.DenseQuBoard(decomp).get_decomp(), decomp)
+        self.assertRaises(Exception, QuantumBoard.DenseQuBoard, {(X,0,0,0,0,0,0,0,0): 0.5})
+
+    def test_moves_match_dict_backend(self):
+        board, dense_board = QuantumBoard.QuBoard(), QuantumBoard.DenseQuBoard()
+        for move in range(3):
+            board, _ = self.quantum.next_move(board, dict(), move)
+            dense_board, _ = self.quantum.next_move(dense_board, dict(), move)
+            self.assertIsInstance(dense_board, QuantumBoard.DenseQuBoard)
+            self.assertDecompEqual(dense_board.get_decomp(), board.get_decomp())
+
+    def test_amplify_matches_dict_backend(self):
+        board, _ = self.quantum.next_move(QuantumBoard.QuBoard(), dict(), 0)
+        board, _ = self.quantum.next_move(board, dict(), 1)
+        dense_board = QuantumBoard.DenseQuBoard(board.get_decomp())
+
+        board.amplify(self.B_X)
+        dense_board.amplify(self.B_X)
+        self.assertDecompEqual(dense_board.get_decomp(), board.get_decomp())
+
+    def test_measure(self):
+        decomp = {(X,0,0,0,0,0,0,0,0): 0.25, (0,0,0,0,X,0,0,0,0): 0.75}
+        dense_board = QuantumBoard.DenseQuBoard(decomp)
+        board = dense_board.measure()
+        self.assertIn(board.get_board(), decomp)
+        self.assertEqual(dense_board.get_decomp(), {board.get_board(): 1})
+
+    def test_classical_moves(self):
+        classical = strategy.ClassicalWithMistakes(self.B_X, self.B_O, self.B_T, self.E)
+        dense_board, _ = self.quantum.next_move(QuantumBoard.DenseQuBoard(), dict(), 0)
+        dense_board, _ = classical.next_move(dense_board, dict(), 1)
+
+        # every board in the superposition is followed by one of its good moves
+        self.assertAlmostEqual(sum(dense_board.get_decomp().values()), 1)
+        for board in dense_board.get_decomp():
+            self.assertEqual(board.count(EMPTY), SIZE - 2)
+            self.assertIn(board, self.B_T)
+
+    def test_amplify_batch(self):
+        # a batch of random superpositions of 50 boards (of which some are good) and the empty board
+        table = StateTable.get_table()
+        rng = np.random.default_rng(0)
+        probs = np.zeros((5, len(table)))
+        for row in probs[:-1]:
+            row[rng.choice(len(table), 50, replace=False)] = rng.random(50)
+            row /= row.sum()
+        probs[-1] = QuantumBoard.DenseQuBoard().get_probs()
+        good = table.mask(self.B_X)
+        self.assertTrue(all(0.0001 < row[good].sum() < 0.9999 for row in probs[:-1]))
+
+        for n in [None, 1, np.array([0, 1, 2, 3, 4]), lambda theta: np.where(theta < 0.5, 2, 1)]:
+            batch = QuantumBoard.amplify_batch(probs, good, n)
+            for game, row in enumerate(probs):
+                theta = np.arcsin(np.sqrt(row[good].sum()))
+                game_n = n(theta) if callable(n) else n[game] if isinstance(n, np.ndarray) else n
+
+                # the independent (dict) implementation of the amplification
+                board = QuantumBoard.QuBoard(QuantumBoard.DenseQuBoard(row.copy()).get_decomp())
+                board.amplify(self.B_X, None if game_n is None else int(game_n))
+                np.testing.assert_allclose(batch[game], QuantumBoard.DenseQuBoard(board.get_decomp()).get_probs(), atol=1e-12)
+
+                # the probability of the good boards after n iterations is sin^2((2n+1) theta)
+                if 0.0001 <= row[good].sum() <= 0.9999:
+                    iterations = np.floor(np.pi / (4 * theta)) if game_n is None else game_n
+                    self.assertAlmostEqual(batch[game][good].sum(), np.sin((2 * iterations + 1) * theta)**2)
+            np.testing.assert_array_equal(batch[-1], probs[-1])  # nothing to amplify on the empty board
+
+class TestPruning(unittest.TestCase):
+    def setUp(self):
+        self.decomp = {(X,0,0,0,0,0,0,0,0): 0.5, (0,X,0,0,0,0,0,0,0): 0.3, (0,0,0,0,X,0,0,0,0): 0.15, (0,0,X,0,0,0,0,0,0): 0.05}
+
+    def test_prune(self):
+        for backend in [QuantumBoard.QuBoard, QuantumBoard.DenseQuBoard]:
+            quboard = backend(dict(self.decomp))
+            self.assertAlmostEqual(quboard.prune(0.1), 0.05)
+            self.assertEqual(len(quboard.get_decomp()), 3)
+            self.assertAlmostEqual(quboard.get_decomp()[(X,0,0,0,0,0,0,0,0)], 0.5 / 0.95)
+
+            quboard = backend(dict(self.decomp))
+            self.assertAlmostEqual(quboard.prune(0.1, top_k=1), 0.5)
+            self.assertEqual(quboard.get_decomp(), {(X,0,0,0,0,0,0,0,0): 1})
+            self.assertEqual(quboard.prune(0.9), 0)  # the most probable board is always kept
+
+    def test_pruned_games(self):
+        B_T, B_X, B_O, E = main.categorize_boards()
+        strategy_pair = (strategy.QuantumFullAmplification(B_X, B_O, B_T, E), strategy.ClassicalWithMistakes(B_X, B_O, B_T, E))
+        effect = truncation.truncation_effect(strategy_pair, X, 0.5, QuantumBoard.Pruning(), 3)
+        self.assertEqual(effect["distance"], 0)
+        self.assertEqual(effect["discarded"].sum(), 0)
+
+        pruning = QuantumBoard.Pruning(top_k=5)
+        for _ in range(3):
+            quboard = game.play_game(strategy_pair, X, pruning=pruning)
+            self.assertLessEqual(len(quboard.get_decomp()), 5)
+            self.assertAlmostEqual(sum(quboard.get_decomp().values()), 1)
+        self.assertEqual(pruning.games, 3)
+        self.assertGreater(pruning.mean_discarded().sum(), 0)
+
+    def test_pruned_sweep(self):
+        board_sets = main.categorize_boards()
+        B_T, B_X, B_O, E = board_sets
+        classical_with_mistakes = strategy.ClassicalWithMistakes(B_X, B_O, B_T, E)
+        strategy_pairs = [(strategy.ClassicalWithoutMistakes(B_X, B_O, B_T, E), classical_with_mistakes), 
+                          (strategy.QuantumFullAmplification(B_X, B_O, B_T, E), classical_with_mistakes)]
+        cells = list(sweep.sweep_cells(strategy_pairs, board_sets, [X], [0.5], 10, 2, workers=1, pruning=(0, 5)))
+        path = os.path.join(tempfile.mkdtemp(), "results.jsonl")
+        with resultStream.ResultWriter(path) as writer:
+            for strategy_pair, M, prob, run, wins, pruned in cells:
+                mode = sweep.cell_mode(strategy_pair, None, (0, 5))
+                if strategy_pair is strategy_pairs[1]:
+                    self.assertEqual((mode, pruned["games"], len(pruned["discarded"])), ("independent pruned [0, 5]", 10, SIZE + 1))
+                else:
+                    # the classical games of the batch engine are not pruned, they are the cells of the exact sweep
+                    self.assertEqual((mode, pruned), (resultStream.INDEPENDENT, None))
+                writer.write_cell(strategy_pair, M, prob, run, 10, 0, wins, mode, pruned)
+
+        # pruned cells are not the exact cells of the same spec
+        cells_exact = list(sweep.sweep_cells(strategy_pairs, board_sets, [X], [0.5], 10, 2, workers=1, 
+                                             skip=resultStream.completed_cells(path)))
+        self.assertEqual([cell[0] for cell in cells_exact], [strategy_pairs[1]] * 2)
+        self.assertEqual(list(sweep.sweep_cells(strategy_pairs, board_sets, [X], [0.5], 10, 2, workers=1, pruning=(0, 5),
+                                                skip=resultStream.completed_cells(path))), [])
+
+        # the discarded probability is summed over the runs of a (pair, M, prob), only pruned cells are summarized
+        summary = resultStream.pruning_summary(path)
+        self.assertEqual(list(summary), [(str(strategy_pairs[1]), X, 0.5)])
+        games, per_ply = summary[(str(strategy_pairs[1]), X, 0.5)]
+        self.assertEqual(games, 20)
+        expected = sum(np.array(pruned["discarded"]) for strategy_pair, _, _, _, _, pruned in cells 
+                       if strategy_pair is strategy_pairs[1]) / 20
+        np.testing.assert_allclose(per_ply, expected)
+        self.assertGreater(sum(per_ply), 0)
+
+class TestTrustedQuBoard(unittest.TestCase):
+    def setUp(self):
+        B_T, B_X, B_O, E = main.categorize_boards()
+        classical_with_mistakes = strategy.ClassicalWithMistakes(B_X, B_O, B_T, E)
+        classical_with_mistakes.set_mistake_prob(0.5)
+        self.strategy_pairs = [(strategy.QuantumFullAmplification(B_X, B_O, B_T, E), classical_with_mistakes),
+                               (strategy.ClassicalWithoutMistakes(B_X, B_O, B_T, E), classical_with_mistakes)]
+        self.rate = QuantumBoard.VALIDATE_RATE
+
+    def tearDown(self):
+        QuantumBoard.VALIDATE_RATE = self.rate
+
+    def play(self, rate, backend):
+        QuantumBoard.VALIDATE_RATE = rate
+        decomps = []
+        for strategy_pair in self.strategy_pairs:
+            for s in strategy_pair:
+                s.set_rng(np.random.default_rng(1))
+            decomps.append(main.play_game(strategy_pair, X, backend=backend).get_decomp())
+        return decomps
+
+    def test_trusted_matches_validated(self):
+        for backend in [QuantumBoard.QuBoard, QuantumBoard.DenseQuBoard]:
+            self.assertEqual(self.play(0, backend), self.play(1, backend))
+
+    def test_sampled_validation(self):
+        invalid = {(X,X,0,0,0,0,0,0,0): 1}
+        QuantumBoard.VALIDATE_RATE = 0
+        self.assertEqual(QuantumBoard.QuBoard.trusted(invalid).get_decomp(), invalid)
+        QuantumBoard.VALIDATE_RATE = 1
+        self.assertRaises(Exception, QuantumBoard.QuBoard.trusted, invalid)
+        self.assertRaises(Exception, QuantumBoard.DenseQuBoard.trusted, np.full(len(StateTable.get_table()), 1.0))
+
+class TestCLI(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_load_spec(self):
+        self.assertEqual(main.load_spec(), main.DEFAULT_SPEC)
+        spec = main.load_spec(self.write("spec.json", '{"iterations": 10, "p": [0, 0.5]}'))
+        self.assertEqual((spec["iterations"], spec["p"], spec["num_runs"]), (10, [0, 0.5], 5))
+        spec = main.load_spec(self.write("spec.toml", 'iterations = 10\nstrategy_pairs = [["QuantumEqualSuperposition", "ClassicalWithMistakes"]]'))
+        self.assertEqual(spec["strategy_pairs"], [["QuantumEqualSuperposition", "ClassicalWithMistakes"]])
+        self.assertRaises(Exception, main.load_spec, self.write("typo.json", '{"iteration": 10}'))
+        self.assertEqual(main.load_spec(self.write("sampling.json", '{"sampling": [0.01, 100, 5000]}'))["sampling"], [0.01, 100, 5000])
+        for sampling in ["[0.01, 0, 5000]", "[0.01, 100, 0]", "[0.01, 100, 50]", "[0, 100, 5000]", "[0.01, 1.5, 5000]", "[0.01, 100]"]:
+            self.assertRaises(Exception, main.load_spec, self.write("sampling.json", f'{{"sampling": {sampling}}}'))
+        self.assertRaises(Exception, main.main, dict(main.DEFAULT_SPEC, sampling=[0.01, 0, 0]))
+
+    def test_light_import(self):
+        modules = subprocess.run([sys.executable, "-c", "import main, sys; print(sorted({'matplotlib', 'tqdm', 'tomllib', "
+                                  "'concurrent.futures.process'} & sys.modules.keys()))"],
+                                 capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(modules.stdout.strip(), "[]")
+
+    def test_headless_sweep(self):
+        plot = os.path.join(self.directory, "ties.png")
+        spec = main.load_spec(self.write("spec.json", json.dumps({
+            "num_runs": 1, "iterations": 4, "p": [0, 0.5], "workers": 1, "stream": os.path.join(self.directory, "results.jsonl"),
+            "strategy_pairs": [["ClassicalWithoutMistakes", "ClassicalWithMistakes"], ["QuantumFullAmplification", "ClassicalWithMistakes"]],
+            "plot": plot, "cache": False})))
+        results = main.main(spec)
+        self.assertEqual(len(results), 2 * 2 * 2)
+        mean, std = results[("(<ClassicalWithoutMistakes>, <ClassicalWithMistakes>)", X, 0)][T]  # exact, always a tie
+        self.assertAlmostEqual(mean, 4)
+        self.assertAlmostEqual(std, 0, places=6)
+        self.assertGreater(os.path.getsize(plot), 0)
+
 class TestHelperFunctions(unittest.TestCase):
     def test_test(self):
         self.assertTrue(True)
 
+def reference_is_valid(board):
+    """ The original Board.is_valid, which does not consult the state table """
+    markings = Counter(board)
+    number_of_winners, winner = ClassicalBoard.Board.has_winner(board)
+
+    return len(board) == SIZE and set(markings.keys()) <= {EMPTY, X, O} and number_of_winners <= 1 \
+        and ((0 <= markings[X] - markings[O] <= 1 and number_of_winners == 0) \
+            or (number_of_winners == 1 and winner == X and markings[X] == markings[O] + 1) \
+            or (number_of_winners == 1 and winner == O and markings[X] == markings[O]))
+
+def reference_next_boards(board):
+    """ The original Board.get_next_boards, which does not consult the state table """
+    if ClassicalBoard.Board.has_winner(board)[0] == 1:
+        return {board}
+    
+    player_to_move = O if board.count(EMPTY) % 2 == 0 else X
+    possible_moves = map(lambda i: helperFunctions.replace(board, i, player_to_move), 
+                         filter(lambda i: board[i] == EMPTY, range(SIZE)))
+    return set(filter(reference_is_valid, possible_moves))
+
+def categorize_boards_by_permutations():
+    """ The original categorization of all permutations of markings, kept as reference for the solver """
+    recorded_boards = {}
+
+    for num_moves_left in range(10):
+        all_board_permutations = set(permutations([2]*ceil((9-num_moves_left)/2) + [1]*floor(((9-num_moves_left)/2)) + [0]*num_moves_left))
+
+        for board in all_board_permutations:
+            if not reference_is_valid(board):
+                continue
+
+            num_winners, winner = ClassicalBoard.Board.has_winner(board)
+            if num_moves_left == 0 or num_winners == 1:
+                recorded_boards[board] = winner
+            else:
+                player_to_move = O if num_moves_left % 2 == 0 else X
+                preferred_win_state = O if player_to_move == X else X
+
+                for move in reference_next_boards(board):
+                    preferred_win_state = helperFunctions.state_max([preferred_win_state, recorded_boards[move]], player_to_move)
+                
+                recorded_boards[board] = preferred_win_state
+
+    B_X = set(filter(lambda x: recorded_boards[x] == X, recorded_boards))
+    B_O = set(filter(lambda x: recorded_boards[x] == O, recorded_boards))
+    B_T = set(filter(lambda x: recorded_boards[x] == T, recorded_boards))
+    
+    C = dict()
+    for board in B_T:
+        other_player = X if board.count(EMPTY) % 2 == 0 else O
+
+        for mistake in filter(lambda x: recorded_boards[x] == other_player, reference_next_boards(board)):
+            C.setdefault(board, set()).add(mistake)
+    
+    return B_T, B_X, B_O, C
+
 class TestMainFunctions(unittest.TestCase):
+    def setUp(self):
+        self.B_T, self.B_X, self.B_O, self.E = main.categorize_boards()
+        self.classical = strategy.ClassicalWithoutMistakes(self.B_X, self.B_O, self.B_T, self.E)
+        self.classical_with_mistakes = strategy.ClassicalWithMistakes(self.B_X, self.B_O, self.B_T, self.E)
+        self.quantum = strategy.QuantumEqualSuperposition(self.B_X, self.B_O, self.B_T, self.E)
+
     def test_test(self):
         self.assertTrue(True)
 
+    def test_exact_outcome_without_mistakes(self):
+        self.classical_with_mistakes.set_mistake_prob(0)
+        for strategy_pair in [(self.classical, self.classical_with_mistakes), (self.quantum, self.classical_with_mistakes)]:
+            for M in [X, O]:
+                outcome = main.exact_outcome(strategy_pair, M)
+                self.assertAlmostEqual(outcome[T], 1)
+
+    def test_exact_outcome_matches_simulation(self):
+        self.classical_with_mistakes.set_mistake_prob(0.3)
+        rng = np.random.default_rng(0)
+        n_games = 20000
+
+        strategy_pair = (self.classical, self.classical_with_mistakes)
+        for M in [X, O]:
+            outcome = main.exact_outcome(strategy_pair, M)
+            self.assertAlmostEqual(sum(outcome.values()), 1)
+            simulated = batchEngine.play_classical_batch(strategy_pair, M, n_games, rng)
+            for W in [X, O, T]:
+                self.assertAlmostEqual(outcome[W], simulated[W] / n_games, delta=0.02)
+
+        random.seed(0)
+        self.quantum.rng = np.random.default_rng(0)
+        self.classical_with_mistakes.rng = np.random.default_rng(1)
+        n_games = 1000
+
+        strategy_pair = (self.quantum, self.classical_with_mistakes)
+        outcome = main.exact_outcome(strategy_pair, X)
+        simulated = {X: 0, O: 0, T: 0}
+        for _ in range(n_games):
+            simulated[main.evaluate(main.play_game(strategy_pair, X, backend=QuantumBoard.DenseQuBoard))] += 1
+        for W in [X, O, T]:
+            self.assertAlmostEqual(outcome[W], simulated[W] / n_games, delta=0.06)
+
+    def test_exact_outcome_requires_linear_strategies(self):
+        amplification = strategy.QuantumFullAmplification(self.B_X, self.B_O, self.B_T, self.E)
+        self.assertFalse(amplification.linear)
+        self.assertRaises(Exception, main.exact_outcome, (amplification, self.classical_with_mistakes), X)
+
+    def test_binomial_results(self):
+        results = main.binomial_results({X: 0.5, O: 0, T: 0.5}, 100)
+        self.assertEqual(results, {X: (50, 5), O: (0, 0), T: (50, 5)})
+
+    def test_categorize_boards(self):
+        B_T, B_X, B_O, C = main.categorize_boards()
+        ref_B_T, ref_B_X, ref_B_O, ref_C = categorize_boards_by_permutations()
+
+        self.assertEqual(B_T, ref_B_T)
+        self.assertEqual(B_X, ref_B_X)
+        self.assertEqual(B_O, ref_B_O)
+        self.assertEqual(C, ref_C)
+        self.assertEqual((len(B_X), len(B_O), len(B_T), len(C)), (len(ref_B_X), len(ref_B_O), len(ref_B_T), len(ref_C)))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file